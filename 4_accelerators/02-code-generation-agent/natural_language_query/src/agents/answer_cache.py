@@ -0,0 +1,83 @@
+# Exact-match tier of the answer cache: approved answers keyed by a hash of the normalized question, so a repeated
+# question is answered without running the agent at all.
+import hashlib
+import time
+
+from .embedding_utils import normalize_text
+
+
+def normalize_question(question):
+    # Case, whitespace and closing punctuation do not make it another question
+    return normalize_text(question).casefold().rstrip(" ?!.")
+
+class ExactAnswerCache():
+    """
+    Approved answers in Redis, one hash per normalized question with the code, the answer text, the data shown to
+    the user and the data version they were computed on.
+
+    get() only returns entries of the current data version and drops older ones, the caller then falls back to the
+    agent. The shown data is stored with the codec when it is at most max_payload_bytes; larger payloads are left out
+    and the caller regenerates them by replaying the code. has_data records whether the answer showed data at all, so
+    answers that never did are not replayed.
+
+    Args:
+        redis_client: Redis client shared by the app instances.
+        codec: codec of the shown data, see utils/codec.py.
+        ttl (int): seconds an answer is kept, None to keep it until the data changes.
+        max_payload_bytes (int): largest encoded payload stored with an answer.
+        key_prefix (str): prefix of the Redis keys.
+    """
+    def __init__(self, redis_client, codec, ttl=None, max_payload_bytes=5 * 1024 * 1024, key_prefix="answer:"):
+        self.redis_client = redis_client
+        self.codec = codec
+        self.ttl = ttl
+        self.max_payload_bytes = max_payload_bytes
+        self.key_prefix = key_prefix
+        self.hits = 0
+        self.stale = 0
+        self.misses = 0
+
+    def _key(self, question):
+        return self.key_prefix + hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()
+
+    def get(self, question, data_version):
+        """
+        Returns {"question", "code", "answer", "has_data", "data"} for a fresh entry, with data None when it was not
+        stored, or None.
+        """
+        key = self._key(question)
+        entry = self.redis_client.hgetall(key)
+        if not entry:
+            self.misses += 1
+            return None
+        if entry.get(b"data_version", b"").decode("utf-8") != data_version:
+            self.redis_client.delete(key)
+            self.stale += 1
+            return None
+        self.hits += 1
+        return {
+            "question": entry[b"question"].decode("utf-8"),
+            "code": entry[b"code"].decode("utf-8"),
+            "answer": entry[b"answer"].decode("utf-8"),
+            "has_data": entry.get(b"has_data") == b"1",
+            "data": self.codec.decode(entry[b"data"]) if entry.get(b"data") else None,
+        }
+
+    def set(self, question, code, answer, data, data_version):
+        mapping = {"question": question, "code": code, "answer": answer, "data_version": data_version, "created": str(time.time()),
+                   "has_data": "0" if data is None else "1", "data": b""}
+        if data is not None:
+            encoded = self.codec.encode(data)
+            if len(encoded) <= self.max_payload_bytes:
+                mapping["data"] = encoded
+        key = self._key(question)
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.delete(key)
+        pipe.hset(key, mapping=mapping)
+        if self.ttl:
+            pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def stats(self):
+        lookups = self.hits + self.stale + self.misses
+        return {"hits": self.hits, "stale": self.stale, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,48 @@
+# Conversation history in Redis, stored as a list with one element per question turn.
+class ConversationStore():
+    """
+    Append-only conversation history of a session.
+
+    Each turn (the user question and the assistant and tool messages that answered it) is appended as one list
+    element with RPUSH, and the list is trimmed to the last max_turns turns with LTRIM in the same transaction, so a
+    turn only uploads its own messages and concurrent turns of a session never overwrite each other. The system
+    prompt is not stored, the orchestrator sets it. load() reads the whole history with one LRANGE.
+
+    Args:
+        redis_client: Redis client, a local Redis or fakeredis work as well.
+        codec: codec used to encode the messages of a turn, see utils/codec.py.
+        max_turns (int): number of turns kept per session.
+        ttl (int): seconds a session's history is kept after its last turn, None to keep it.
+        key_prefix (str): prefix of the Redis keys.
+    """
+    def __init__(self, redis_client, codec, max_turns, ttl=None, key_prefix="conversation:"):
+        self.redis_client = redis_client
+        self.codec = codec
+        self.max_turns = max_turns
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+
+    def _key(self, session_id):
+        return self.key_prefix + session_id
+
+    def append_turn(self, session_id, messages):
+        key = self._key(session_id)
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.rpush(key, self.codec.encode(list(messages)))
+        pipe.ltrim(key, -self.max_turns, -1)
+        if self.ttl:
+            pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def load(self, session_id):
+        return [message for turn in self.redis_client.lrange(self._key(session_id), 0, -1) for message in self.codec.decode(turn)]
+
+    def clear(self, session_id):
+        self.redis_client.delete(self._key(session_id))
+
+def last_turn(conversation):
+    # Messages of the last turn: the last user message and everything after it
+    for idx in range(len(conversation) - 1, -1, -1):
+        if dict(conversation[idx]).get("role") == "user":
+            return conversation[idx:]
+    return []
@@ -0,0 +1,192 @@
+# Embedding helpers shared by the agents: a two-tier cache and a request batcher in front of the embedding deployment.
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_text(text):
+    # Whitespace differences should not cost another embedding call. Case is kept, "US" and "us" embed differently
+    return " ".join(text.split())
+
+class EmbeddingCache():
+    """
+    Cache of embeddings keyed by (model, normalized text).
+
+    The first tier is an in-process LRU with size and TTL eviction. The optional second tier is a Redis client shared
+    by all processes, where vectors are stored as raw float32 bytes.
+
+    Args:
+        max_size (int): maximum number of embeddings kept in process.
+        ttl (float): seconds an embedding stays valid in both tiers, None to keep them until evicted.
+        redis_client: optional Redis client for the shared tier.
+        key_prefix (str): prefix of the Redis keys.
+    """
+    def __init__(self, max_size=10000, ttl=None, redis_client=None, key_prefix="emb:"):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.redis_client = redis_client
+        self.key_prefix = key_prefix
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def _key(self, model, text):
+        return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, vector = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return vector
+
+    def _set_local(self, key, vector):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, model, text):
+        key = self._key(model, text)
+        vector = self._get_local(key)
+        if vector is not None:
+            self.hits += 1
+            return vector.tolist()
+        if self.redis_client is not None:
+            try:
+                value = self.redis_client.get(self.key_prefix + key)
+            except Exception as e:
+                print("embedding cache redis read failed: ", e)
+                value = None
+            if value is not None:
+                vector = np.frombuffer(value, dtype=np.float32)
+                self._set_local(key, vector)
+                self.redis_hits += 1
+                return vector.tolist()
+        self.misses += 1
+        return None
+
+    def set(self, model, text, embedding):
+        key = self._key(model, text)
+        vector = np.asarray(embedding, dtype=np.float32)
+        self._set_local(key, vector)
+        if self.redis_client is not None:
+            try:
+                self.redis_client.set(self.key_prefix + key, vector.tobytes(), ex=int(self.ttl) if self.ttl else None)
+            except Exception as e:
+                print("embedding cache redis write failed: ", e)
+
+    def get_or_compute(self, model, text, compute):
+        embedding = self.get(model, text)
+        if embedding is None:
+            embedding = compute()
+            self.set(model, text, embedding)
+        return embedding
+
+    async def aget_or_compute(self, model, text, compute):
+        # Same as get_or_compute for a coroutine function, used by the async agents
+        embedding = self.get(model, text)
+        if embedding is None:
+            embedding = await compute()
+            self.set(model, text, embedding)
+        return embedding
+
+    def stats(self):
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.redis_hits) / lookups if lookups else 0.0,
+            "size": len(self._entries),
+        }
+
+class EmbeddingBatcher():
+    """
+    Coalesces concurrent embedding requests into one embeddings.create call with a list input.
+
+    Requests are collected for up to max_wait seconds or until max_batch_size texts are pending, whichever comes first.
+    The batcher runs on its own event loop thread, so requests from any thread or event loop share the same batches:
+    async callers await embed(), sync callers block on embed_sync().
+
+    Args:
+        async_client: AsyncAzureOpenAI client used to send the batched requests.
+        model (str): default embedding deployment.
+        max_batch_size (int): maximum number of texts per request.
+        max_wait (float): seconds to wait for more requests before sending a batch.
+    """
+    def __init__(self, async_client, model=None, max_batch_size=64, max_wait=0.005):
+        self.async_client = async_client
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending = {}  # model -> list of (text, future)
+        self._flush_handles = {}
+        self._tasks = set()
+        self._loop = None
+        self._loop_lock = threading.Lock()
+        self.requests_sent = 0
+        self.texts_embedded = 0
+
+    def _get_loop(self):
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="embedding-batcher", daemon=True).start()
+            return self._loop
+
+    async def _submit(self, text, model):
+        future = asyncio.get_running_loop().create_future()
+        pending = self._pending.setdefault(model, [])
+        pending.append((text, future))
+        if len(pending) >= self.max_batch_size:
+            self._flush(model)
+        elif model not in self._flush_handles:
+            self._flush_handles[model] = asyncio.get_running_loop().call_later(self.max_wait, self._flush, model)
+        return await future
+
+    def _flush(self, model):
+        handle = self._flush_handles.pop(model, None)
+        if handle is not None:
+            handle.cancel()
+        batch = self._pending.pop(model, [])
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._send(model, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, model, batch):
+        # Identical texts in one batch are only embedded once
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            response = await self.async_client.embeddings.create(input=texts, model=model)
+            embeddings = {texts[item.index]: item.embedding for item in response.data}
+            self.requests_sent += 1
+            self.texts_embedded += len(texts)
+            for text, future in batch:
+                if not future.done():
+                    future.set_result(embeddings[text])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    async def embed(self, text, model=None):
+        future = asyncio.run_coroutine_threadsafe(self._submit(text, model or self.model), self._get_loop())
+        return await asyncio.wrap_future(future)
+
+    def embed_sync(self, text, model=None):
+        return asyncio.run_coroutine_threadsafe(self._submit(text, model or self.model), self._get_loop()).result()
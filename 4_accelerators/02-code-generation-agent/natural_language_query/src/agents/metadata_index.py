@@ -0,0 +1,72 @@
+# Parsed and precomputed view of the metadata file (analytic scenarios, tables and their relationships) used by
+# retrieve_context, built once and rebuilt only when the file changes.
+import json
+import os
+import threading
+
+
+class MetadataSnapshot():
+    """
+    Everything retrieve_context needs from one version of the metadata file.
+
+    Args:
+        data (dict): the parsed metadata file.
+    """
+    def __init__(self, data):
+        analytic_scenarios = data.get("analytic_scenarios", {})
+        all_tables = data.get("tables", {})
+        self.scenarios = set(analytic_scenarios)
+        # The markdown table of the scenario router prompt
+        rows = "".join(f"| {name} | {scenario['description']} |\n" for name, scenario in analytic_scenarios.items())
+        self.scenario_list_md = f"| Scenario | Description |\n| --- | --- |\n{rows}"
+        self.descriptions = {name: scenario["description"] for name, scenario in analytic_scenarios.items()}
+        # Context fragments, joined per request instead of formatted per request
+        self.scenario_tables = {name: list(dict.fromkeys(tables)) for name, tables in data.get("scenario_tables", {}).items()}
+        self.table_lines = {table: f"- table_name: {table} - description: {info['description']} - columns: {info['columns']}\n" for table, info in all_tables.items()}
+        self.rule_lines = {name: f"- {name}: {str(scenario['rules'])}\n" for name, scenario in analytic_scenarios.items()}
+        # Relationships by table, so only the neighbours of the selected tables are visited instead of every table pair
+        self.adjacency = {}
+        for table1, table2, relationship in data.get("table_relationships", []):
+            if table1 != table2:
+                self.adjacency.setdefault(table1, {})[table2] = relationship
+
+    def context(self, scenario_names):
+        tables = list(dict.fromkeys(table for name in scenario_names for table in self.scenario_tables.get(name, [])))
+        selected = set(tables)
+        relationships = [f"- {table1}, {table2}:{relationship}\n" for table1 in tables
+                         for table2, relationship in self.adjacency.get(table1, {}).items() if table2 in selected]
+        return "".join([
+            "Following tables might be relevant to the question: \n",
+            *(self.table_lines[table] for table in tables),
+            "\nTable relationships: \n",
+            *relationships,
+            "\nFollowing rules might be relevant: \n",
+            *(self.rule_lines[name] for name in scenario_names),
+        ])
+
+class MetadataIndex():
+    """
+    Memoized MetadataSnapshot of a metadata file.
+
+    current() costs one stat call as long as the file is unchanged; when its modification time or size changes the
+    file is parsed again and the new snapshot replaces the old one, callers holding the old one keep a consistent view.
+
+    Args:
+        path (str): path of the metadata file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._snapshot = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        stat = os.stat(self.path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    with open(self.path, "r") as file:
+                        self._snapshot = MetadataSnapshot(json.load(file))
+                    self._version = version
+        return self._snapshot
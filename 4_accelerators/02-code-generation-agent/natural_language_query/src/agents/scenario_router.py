@@ -0,0 +1,84 @@
+# Local router from business concepts to the analytic scenarios of the metadata file, by cosine similarity of their
+# embeddings. Used by retrieve_context before the scenario router completion, which only runs when this is unsure.
+import asyncio
+import re
+
+import numpy as np
+
+
+def split_concepts(business_concepts):
+    # "total sales, top customers" asks about two concepts, each has to match a scenario on its own
+    concepts = [concept.strip(" '\"") for concept in re.split(r"[,;\n]", business_concepts)]
+    return [concept for concept in concepts if concept]
+
+def scenario_text(name, description):
+    return f"{name}: {description}"
+
+class ScenarioRouter():
+    """
+    Routes business concepts to scenarios without a completion when the match is clear.
+
+    The scenarios of a metadata snapshot are embedded once (name and description) into a normalized matrix, and each
+    concept is scored against all of them with one matrix product. A concept is routed to its best scenario when that
+    scores at least min_score and leads the runner-up by at least margin; if any concept is below that, route() returns
+    None and the caller asks the model instead.
+
+    Args:
+        embed: coroutine function returning the embedding of a text, e.g. tools.get_embedding.
+        margin (float): minimum lead of the best scenario over the second best.
+        min_score (float): minimum cosine similarity of the best scenario.
+    """
+    def __init__(self, embed, margin=0.05, min_score=0.0):
+        self.embed = embed
+        self.margin = margin
+        self.min_score = min_score
+        self._snapshot = None
+        self._names = None
+        self._matrix = None
+        self.routed = 0
+        self.fallbacks = 0
+
+    async def _scenario_matrix(self, metadata):
+        # Rebuilt when the metadata index hands out a new snapshot, i.e. when the metadata file changed
+        if self._snapshot is not metadata:
+            names = list(metadata.descriptions)
+            embeddings = await asyncio.gather(*[self.embed(scenario_text(name, metadata.descriptions[name])) for name in names])
+            matrix = np.asarray(embeddings, dtype=np.float32)
+            matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+            self._snapshot, self._names, self._matrix = metadata, names, matrix
+        return self._names, self._matrix
+
+    async def scores(self, metadata, business_concepts):
+        """
+        Returns the scenario names and a (concepts x scenarios) matrix of cosine similarities.
+        """
+        names, matrix = await self._scenario_matrix(metadata)
+        concepts = split_concepts(business_concepts) or [business_concepts]
+        vectors = np.asarray(await asyncio.gather(*[self.embed(concept) for concept in concepts]), dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return names, vectors @ matrix.T
+
+    def decide(self, names, scores, margin=None, min_score=None):
+        # Scenario names for the scored concepts, or None when a concept has no clear best scenario
+        margin = self.margin if margin is None else margin
+        min_score = self.min_score if min_score is None else min_score
+        if len(names) == 0:
+            return None
+        if len(names) == 1:
+            return names[:1] if (scores[:, 0] >= min_score).all() else None
+        top_two = np.sort(scores, axis=1)[:, -2:]
+        if (top_two[:, 1] < min_score).any() or (top_two[:, 1] - top_two[:, 0] < margin).any():
+            return None
+        return list(dict.fromkeys(names[index] for index in scores.argmax(axis=1)))
+
+    async def route(self, metadata, business_concepts):
+        scenario_names = self.decide(*await self.scores(metadata, business_concepts))
+        if scenario_names is None:
+            self.fallbacks += 1
+        else:
+            self.routed += 1
+        return scenario_names
+
+    def stats(self):
+        calls = self.routed + self.fallbacks
+        return {"routed": self.routed, "fallbacks": self.fallbacks, "routed_rate": self.routed / calls if calls else 0.0}
@@ -0,0 +1,194 @@
+# Backends of the semantic cache of answered questions behind get_cache and add_to_cache: the Azure AI Search index
+# created by utils/create_cache_index.py, or a local SQLite file for self-hosted and offline use.
+import asyncio
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+import numpy as np
+from azure.search.documents.models import VectorizedQuery
+
+RRF_K = 60  # rank constant of reciprocal rank fusion, the one Azure AI Search uses for hybrid queries
+
+
+class AzureSearchCache():
+    """
+    Semantic cache on the Azure AI Search index created by utils/create_cache_index.py: a hybrid query of the full
+    text of the question and its embedding, scored by Azure with reciprocal rank fusion.
+
+    Args:
+        search_client: async SearchClient of the index.
+    """
+    def __init__(self, search_client):
+        self.search_client = search_client
+
+    async def search(self, question, vector, top=2):
+        results = await self.search_client.search(
+            search_text=question,
+            vector_queries=[VectorizedQuery(vector=vector, k_nearest_neighbors=3, fields="questionVector")],
+            select=["question", "code", "answer"],
+            top=top
+        )
+        return [{"question": result["question"], "code": result["code"], "answer": result["answer"], "score": result["@search.score"]} async for result in results]
+
+    async def add(self, question, code, answer, vector):
+        await self.search_client.upload_documents(documents=[{"id": str(uuid.uuid4()), "question": question, "code": code, "questionVector": vector, "answer": answer}])
+
+# Words of nearly every question, BM25 gives them almost no weight but matching them costs a scan of most entries
+STOPWORDS = {"a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "give", "how", "i",
+             "in", "is", "it", "list", "me", "of", "on", "or", "show", "that", "the", "their", "there", "this", "to",
+             "was", "we", "were", "what", "when", "where", "which", "who", "with", "you"}
+
+def fts_query(text):
+    # Any of the words of the text, quoted so FTS5 operators and punctuation in questions are taken literally
+    words = [word for word in re.findall(r"\w+", text.lower()) if word not in STOPWORDS]
+    return " OR ".join(f'"{word}"' for word in dict.fromkeys(words))
+
+class LocalSemanticCache():
+    """
+    Semantic cache in a local SQLite file with the same hybrid query as the Azure AI Search index: an FTS5 BM25 query
+    on question, code and answer plus the k nearest question embeddings, fused with reciprocal rank fusion, so the
+    scores and SEMANTIC_HIT_THRESHOLD mean the same with both backends.
+
+    Entries and their embeddings are persisted in the file, the embeddings are also kept in memory as one normalized
+    NumPy matrix, so a lookup is a matrix-vector product and one FTS5 query. A question whose embedding is at least
+    dedup_threshold similar to a cached one replaces that entry instead of adding a new one, and the least recently
+    used entries are evicted above max_entries.
+
+    Args:
+        path (str): SQLite file, created if missing.
+        max_entries (int): maximum number of cached questions.
+        dedup_threshold (float): cosine similarity above which two questions are the same question.
+        k_nearest_neighbors (int): size of the vector ranking, as in the Azure query.
+        text_candidates (int): size of the full text ranking.
+    """
+    def __init__(self, path, max_entries=10000, dedup_threshold=0.97, k_nearest_neighbors=3, text_candidates=50):
+        self.path = path
+        self.max_entries = max_entries
+        self.dedup_threshold = dedup_threshold
+        self.k_nearest_neighbors = k_nearest_neighbors
+        self.text_candidates = text_candidates
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS entries (id INTEGER PRIMARY KEY, question TEXT, code TEXT, answer TEXT, vector BLOB, last_used REAL)")
+        self._connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(question, code, answer, content='entries', content_rowid='id')")
+        self._connection.commit()
+        rows = self._connection.execute("SELECT id, vector, last_used FROM entries ORDER BY id").fetchall()
+        self._ids = np.array([row[0] for row in rows], dtype=np.int64)
+        # Row i of the buffer is the embedding of _ids[i], the buffer grows by doubling so adds stay cheap
+        self._vectors = np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows]) if rows else None
+        # Recency is tracked in memory so lookups never write, it is persisted with the next add
+        self._last_used = np.array([row[2] for row in rows], dtype=np.float64)
+        self._used_since_flush = set()
+
+    @property
+    def _matrix(self):
+        return self._vectors[:len(self._ids)] if self._vectors is not None else None
+
+    def _append_vector(self, vector):
+        count = len(self._ids)
+        if self._vectors is None:
+            self._vectors = np.empty((16, len(vector)), dtype=np.float32)
+        elif count == len(self._vectors):
+            grown = np.empty((2 * count, self._vectors.shape[1]), dtype=np.float32)
+            grown[:count] = self._vectors
+            self._vectors = grown
+        self._vectors[count] = vector
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _vector_ranking(self, vector):
+        if not len(self._ids):
+            return [], np.empty(0, dtype=np.float32)
+        similarities = self._matrix @ vector
+        k = min(self.k_nearest_neighbors, len(similarities))
+        nearest = np.argpartition(-similarities, k - 1)[:k]
+        nearest = nearest[np.argsort(-similarities[nearest])]
+        return [int(self._ids[index]) for index in nearest], similarities
+
+    def _text_ranking(self, question):
+        query = fts_query(question)
+        if not query:
+            return []
+        return [row[0] for row in self._connection.execute("SELECT rowid FROM entries_fts WHERE entries_fts MATCH ? ORDER BY bm25(entries_fts) LIMIT ?", (query, self.text_candidates))]
+
+    def search_sync(self, question, vector, top=2):
+        vector = self._normalize(vector)
+        with self._lock:
+            scores = {}
+            for ranking in (self._vector_ranking(vector)[0], self._text_ranking(question)):
+                for rank, entry_id in enumerate(ranking, start=1):
+                    scores[entry_id] = scores.get(entry_id, 0.0) + 1.0 / (RRF_K + rank)
+            best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top]
+            results = []
+            for entry_id, score in best:
+                question_text, code, answer = self._connection.execute("SELECT question, code, answer FROM entries WHERE id = ?", (entry_id,)).fetchone()
+                results.append({"question": question_text, "code": code, "answer": answer, "score": score})
+            now = time.time()
+            for entry_id, _ in best:
+                self._last_used[np.searchsorted(self._ids, entry_id)] = now
+                self._used_since_flush.add(entry_id)
+        return results
+
+    def add_sync(self, question, code, answer, vector):
+        vector = self._normalize(vector)
+        with self._lock, self._connection:
+            self._flush_last_used()
+            _, similarities = self._vector_ranking(vector)
+            if len(similarities) and similarities.max() >= self.dedup_threshold:
+                # Same question asked again, the newer solution replaces the cached one
+                index = int(similarities.argmax())
+                entry_id = int(self._ids[index])
+                self._delete_fts(entry_id)
+                self._connection.execute("UPDATE entries SET question = ?, code = ?, answer = ?, vector = ?, last_used = ? WHERE id = ?",
+                                         (question, code, answer, vector.tobytes(), time.time(), entry_id))
+                self._connection.execute("INSERT INTO entries_fts (rowid, question, code, answer) VALUES (?, ?, ?, ?)", (entry_id, question, code, answer))
+                self._vectors[index] = vector
+                self._last_used[index] = time.time()
+                return
+            entry_id = self._connection.execute("INSERT INTO entries (question, code, answer, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                                                (question, code, answer, vector.tobytes(), time.time())).lastrowid
+            self._connection.execute("INSERT INTO entries_fts (rowid, question, code, answer) VALUES (?, ?, ?, ?)", (entry_id, question, code, answer))
+            self._append_vector(vector)
+            self._ids = np.append(self._ids, entry_id)
+            self._last_used = np.append(self._last_used, time.time())
+            if len(self._ids) > self.max_entries:
+                self._evict(len(self._ids) - self.max_entries)
+
+    def _delete_fts(self, entry_id):
+        # External content FTS5 tables are updated by deleting the old row values explicitly
+        question, code, answer = self._connection.execute("SELECT question, code, answer FROM entries WHERE id = ?", (entry_id,)).fetchone()
+        self._connection.execute("INSERT INTO entries_fts (entries_fts, rowid, question, code, answer) VALUES ('delete', ?, ?, ?, ?)", (entry_id, question, code, answer))
+
+    def _flush_last_used(self):
+        if self._used_since_flush:
+            self._connection.executemany("UPDATE entries SET last_used = ? WHERE id = ?",
+                                         [(float(self._last_used[np.searchsorted(self._ids, entry_id)]), entry_id) for entry_id in self._used_since_flush])
+            self._used_since_flush.clear()
+
+    def _evict(self, count):
+        # Least recently used or added entries first
+        evicted = self._ids[np.argsort(self._last_used, kind="stable")[:count]].tolist()
+        for entry_id in evicted:
+            self._delete_fts(entry_id)
+        self._connection.executemany("DELETE FROM entries WHERE id = ?", [(entry_id,) for entry_id in evicted])
+        keep = ~np.isin(self._ids, evicted)
+        self._ids, self._vectors, self._last_used = self._ids[keep], self._matrix[keep], self._last_used[keep]
+
+    def __len__(self):
+        return len(self._ids)
+
+    # Lookups take milliseconds with thousands of entries and adds write to SQLite, so the async interface runs them
+    # in the default executor instead of blocking the event loop shared by all sessions; _lock serializes them
+    async def search(self, question, vector, top=2):
+        return await asyncio.get_running_loop().run_in_executor(None, self.search_sync, question, vector, top)
+
+    async def add(self, question, code, answer, vector):
+        await asyncio.get_running_loop().run_in_executor(None, self.add_sync, question, code, answer, vector)
@@ -1,17 +1,24 @@
 from pathlib import Path  
+import asyncio  
 import json  
 import os  
-from openai import AzureOpenAI  
+import uuid  
+from openai import AsyncAzureOpenAI  
 import yaml  
 from .tools import (  
+    call_tool,  
+    stream_chat_completion,  
     check_args,  
     get_cache,  
+    get_cached_answer,  
     transform_tools,  
     execute_python_code,  
     retrieve_context,  
-    redis_get,  
-    redis_set  
+    ContextPrefetch,  
+    redis_client,  
+    redis_codec  
 )  
+from .conversation_store import ConversationStore, last_turn  
 from tenacity import retry, wait_random_exponential, stop_after_attempt  
 import pandas as pd  
 from dotenv import load_dotenv  
@@ -24,10 +31,19 @@ MAX_ERROR_RUN = 3
 MAX_RUN_PER_QUESTION = 10  
 MAX_QUESTION_TO_KEEP = 3  
 MAX_QUESTION_WITH_DETAIL_HIST = 1  
+PREFETCH_CONTEXT = os.getenv("PREFETCH_CONTEXT", "true").lower() == "true"  
+  
+# clean_up_history keeps the last MAX_QUESTION_TO_KEEP - 1 questions, the stored history keeps as many turns  
+conversation_store = ConversationStore(  
+    redis_client,  
+    redis_codec,  
+    max_turns=MAX_QUESTION_TO_KEEP - 1,  
+    ttl=int(os.getenv("CONVERSATION_TTL")) if os.getenv("CONVERSATION_TTL") else None,  
+)  
   
 chat_engine1 = os.getenv("AZURE_OPENAI_DEPLOYMENT1")  
 chat_engine2 = os.getenv("AZURE_OPENAI_DEPLOYMENT2")  
-client = AzureOpenAI(  
+client = AsyncAzureOpenAI(  
     api_key=os.environ.get("AZURE_OPENAI_API_KEY"),  
     api_version=os.getenv("AZURE_OPENAI_API_VERSION"),  
     azure_endpoint=os.environ.get("AZURE_OPENAI_ENDPOINT"),  
@@ -65,7 +81,24 @@ class Smart_Agent:
         self.functions_spec = functions_spec  
         self.functions_list = functions_list  
   
-    async def run(self, session_id, conversation):  
+    def offers_tool(self, name):  
+        # Whether the model of this agent is given the tool, functions_list may hold more than it is offered  
+        return any(tool["function"]["name"] == name for tool in self.functions_spec)  
+  
+    async def run(self, session_id, conversation, prefetch=None):  
+        async for event in self.run_stream(session_id, conversation, prefetch):  
+            if event["type"] == "done":  
+                return event["switch_role"], event["code"], event["content"], event["data"]  
+  
+    async def run_stream(self, session_id, conversation, prefetch=None):  
+        """  
+        Same as run, but an async generator of events while the agent works.  
+        prefetch is an optional ContextPrefetch of the question, which answers compatible retrieve_context calls.  
+        Events:  
+        {"type": "token", "content": ...} for each piece of assistant text,  
+        {"type": "tool_call", "name": ...} and {"type": "tool_result", "name": ..., "content": ...} around each tool call,  
+        and finally {"type": "done", "switch_role": ..., "code": ..., "content": ..., "data": ...}.  
+        """  
         execution_error_count = 0  
         response_message = None  
         data = {}  
@@ -87,61 +120,80 @@ class Smart_Agent:
                 print(f"resetting history due to too many errors ({execution_error_count} errors) in the code execution")  
                 execution_error_count = 0  
   
-            response = client.chat.completions.create(  
+            async for event_type, value in stream_chat_completion(  
+                client,  
                 model=self.engine,  # The deployment name you chose when you deployed the GPT-35-turbo or GPT-4 model.  
                 messages=conversation,  
                 tools=self.functions_spec,  
                 tool_choice='auto',  
                 temperature=0.2,  
-            )  
+            ):  
+                if event_type == "token":  
+                    yield {"type": "token", "content": value}  
+                else:  
+                    response_message = value  
             run_count += 1  
-            response_message = response.choices[0].message  
             if response_message.content is None:  
                 response_message.content = ""  
             tool_calls = response_message.tool_calls  
   
             if tool_calls:  
                 conversation.append(response_message)  # extend conversation with assistant's reply  
+                # Validate the calls in order, the valid ones are then run concurrently  
+                pending_calls = []  
+                stop_action = None  
                 for tool_call in tool_calls:  
                     function_name = tool_call.function.name  
                     print("Recommended Function call:")  
                     print(function_name)  
                     print()  
                     if function_name == "get_additional_context":  
-                        switch_role = True  
-                        run_count = 0  
+                        stop_action = "switch_role"  
                         break  
                     if function_name not in self.functions_list:  
                         print(("Function " + function_name + " does not exist, retrying"))  
-                        function_response = "Function " + function_name + " does not exist"  
+                        pending_calls.append((tool_call, None, None))  
+                        continue  
+                    function_to_call = self.functions_list[function_name]  
+                    try:  
+                        function_args = json.loads(tool_call.function.arguments)  
+                    except json.JSONDecodeError as e:  
+                        print(e)  
+                        stop_action = "pop"  
+                        break  
+                    if function_name == "execute_python_code":  
+                        function_args["session_id"] = session_id  
+                    if check_args(function_to_call, function_args) is False:  
+                        print("check arg failed")  
+                        stop_action = "pop"  
+                        break  
+                    if function_name == "retrieve_context" and prefetch is not None and prefetch.covers(function_args["business_concepts"]):  
+                        pending_calls.append((tool_call, function_args, prefetch.retrieve_context(function_args["business_concepts"])))  
                     else:  
-                        function_to_call = self.functions_list[function_name]  
-                        try:  
-                            function_args = json.loads(tool_call.function.arguments)  
-                        except json.JSONDecodeError as e:  
-                            print(e)  
-                            conversation.pop()  
-                            break  
-                        if function_name == "execute_python_code":  
-                            function_args["session_id"] = session_id  
-                        if check_args(function_to_call, function_args) is False:  
-                            print("check arg failed")  
-                            conversation.pop()  
-                            break  
-                        if function_name == "execute_python_code":  
-                            function_response = await function_to_call(**function_args)  
-                            print("done execute python code ,", function_response)  
-                            data_output = redis_get('data' + session_id)  
-                            if data_output is not None:  
-                                data[tool_call.id] = data_output  
-                            if "error" in function_response:  
-                                execution_error_count += 1  
-                                print("error")  
-                            else:  
-                                code = function_args["python_code"]  
+                        pending_calls.append((tool_call, function_args, call_tool(function_to_call, function_args)))  
+                    yield {"type": "tool_call", "name": function_name}  
+  
+                # The turn takes as long as the slowest tool, results are appended in the original tool call order  
+                results = iter(await asyncio.gather(*[task for _, _, task in pending_calls if task is not None]))  
+                for tool_call, function_args, task in pending_calls:  
+                    function_name = tool_call.function.name  
+                    if task is None:  
+                        function_response = "Function " + function_name + " does not exist"  
+                    elif function_name == "execute_python_code":  
+                        execution_result = next(results)  
+                        function_response = execution_result["output"]  
+                        print("done execute python code ,", function_response)  
+                        if execution_result["data"] is not None:  
+                            data[tool_call.id] = execution_result["data"]  
+                        if "error" in function_response:  
+                            execution_error_count += 1  
+                            print("error")  
                         else:  
-                            function_response = str(function_to_call(**function_args))  
-                        print()  
+                            code = function_args["python_code"]  
+                    else:  
+                        function_response = str(next(results))  
+                    print()  
+                    yield {"type": "tool_result", "name": function_name, "content": function_response}  
                     conversation.append(  
                         {  
                             "tool_call_id": tool_call.id,  
@@ -150,13 +202,17 @@ class Smart_Agent:
                             "content": function_response,  
                         }  
                     )  
-                    continue  
+                if stop_action == "switch_role":  
+                    switch_role = True  
+                    run_count = 0  
+                elif stop_action == "pop":  
+                    conversation.pop()  
             else:  
                 break  
   
         conversation.append(response_message)  
         assistant_response = dict(response_message).get('content')  
-        return switch_role, code, assistant_response, data  
+        yield {"type": "done", "switch_role": switch_role, "code": code, "content": assistant_response, "data": data}  
   
 def transform_tools(tools):  
     transformed_tools = []  
@@ -200,13 +256,11 @@ class Agent_Orchestrator:
         agent2 = Smart_Agent(persona=coder2.get("persona"), functions_list=coder2_functions, functions_spec=coder2_functions_spec)  
         self.agents = [agent1, agent2]  
         self.session_id = session_id  
-        init_history = redis_get(self.session_id)  
-        if init_history:  
-            self.conversation = init_history  
         if init_message is not None:  
             self.conversation = [{"role": "system", "content": self.agents[active_agent].persona}, {"role": "assistant", "content": init_message}]  
         else:  
             self.conversation = [{"role": "system", "content": self.agents[active_agent].persona}]  
+        self.conversation.extend(conversation_store.load(self.session_id))  
         self.active_agent = active_agent  
   
     def switch_persona(self, similiar_question=None):  
@@ -225,24 +279,72 @@ class Agent_Orchestrator:
     async def run(self, user_input, conversation=None):  
         if user_input is None:  # if no input return init message  
             return self.conversation, self.conversation[1]["content"]  
+        async for event in self.run_stream(user_input, conversation):  
+            if event["type"] == "done":  
+                return event["code"], event["conversation"], event["content"], event["data"]  
+  
+    async def run_stream(self, user_input, conversation=None):  
+        # Streaming version of run, forwards the events of the active agent and ends with a "done" event  
+        # carrying code, conversation, content and data  
         if conversation is not None:  # if no history return init message  
             self.conversation = conversation  
-        similiar_question = get_cache(user_input)  
-        if self.active_agent == 0:  
-            if len(similiar_question) > 0:  
-                self.switch_persona(similiar_question)  
-        else:  
-            if len(similiar_question) > 0:  
-                self.switch_persona(similiar_question)  # updating coder 2 with similiar questions  
+        # The semantic cache lookup starts right away and runs while the exact answer cache is checked  
+        cache_task = asyncio.create_task(get_cache(user_input))  
+        cache_task.add_done_callback(lambda task: task.cancelled() or task.exception())  
+        prefetch = None  
+  
+        def cancel_speculative_work():  
+            cache_task.cancel()  
+            if prefetch is not None:  
+                prefetch.cancel()  
+  
+        try:  
+            cached_answer = await get_cached_answer(user_input, self.session_id)  
+            if cached_answer is not None:  
+                # Exact repeat of an approved question, answered without the agent. The app stops iterating after  
+                # the "done" event without closing the generator, so the finally below may only run much later  
+                cancel_speculative_work()  
+                self.conversation.append({"role": "user", "content": user_input})  
+                clean_up_history(self.conversation, max_q_with_detail_hist=MAX_QUESTION_WITH_DETAIL_HIST, max_q_to_keep=MAX_QUESTION_TO_KEEP)  
+                data = {}  
+                if cached_answer["data"] is not None:  
+                    # The shown data belongs to a tool message, as in an agent run, so the app shows it again on reruns  
+                    tool_call_id = "cached_" + uuid.uuid4().hex  
+                    arguments = {"assumptions": "", "goal": "Approved solution of the same question", "python_code": cached_answer["code"]}  
+                    self.conversation.append({"role": "assistant", "content": "", "tool_calls": [{"id": tool_call_id, "type": "function", "function": {"name": "execute_python_code", "arguments": json.dumps(arguments)}}]})  
+                    self.conversation.append({"tool_call_id": tool_call_id, "role": "tool", "name": "execute_python_code", "content": "Shown to the user from the answer cache"})  
+                    data[tool_call_id] = cached_answer["data"]  
+                self.conversation.append({"role": "assistant", "content": cached_answer["answer"]})  
+                conversation_store.append_turn(self.session_id, last_turn(self.conversation))  
+                yield {"type": "token", "content": cached_answer["answer"]}  
+                yield {"type": "done", "code": cached_answer["code"], "conversation": self.conversation, "content": cached_answer["answer"], "data": data}  
+                return  
+            similiar_question = await cache_task  
+            if self.active_agent == 0:  
+                if len(similiar_question) > 0:  
+                    self.switch_persona(similiar_question)  
             else:  
-                self.switch_persona()  # no similiar questions, switch to coder 1  
-        self.conversation.append({"role": "user", "content": user_input})  
-        clean_up_history(self.conversation, max_q_with_detail_hist=MAX_QUESTION_WITH_DETAIL_HIST, max_q_to_keep=MAX_QUESTION_TO_KEEP)  
-        switch_persona, code, assistant_response, data = await self.agents[self.active_agent].run(self.session_id, self.conversation)  
-        if switch_persona:  
-            self.switch_persona()  
-            reset_history_to_last_question(self.conversation)  
-            switch_persona, code, assistant_response, data = await self.agents[self.active_agent].run(self.session_id, self.conversation)  
-        redis_set(self.session_id, self.conversation)  
-        return code, self.conversation, assistant_response, data  
+                if len(similiar_question) > 0:  
+                    self.switch_persona(similiar_question)  # updating coder 2 with similiar questions  
+                else:  
+                    self.switch_persona()  # no similiar questions, switch to coder 1  
+            if PREFETCH_CONTEXT and self.agents[self.active_agent].offers_tool("retrieve_context"):  
+                # Context for the raw question is retrieved while the model decides which tools to call  
+                prefetch = ContextPrefetch(user_input)  
+            self.conversation.append({"role": "user", "content": user_input})  
+            clean_up_history(self.conversation, max_q_with_detail_hist=MAX_QUESTION_WITH_DETAIL_HIST, max_q_to_keep=MAX_QUESTION_TO_KEEP)  
+            async for event in self.agents[self.active_agent].run_stream(self.session_id, self.conversation, prefetch):  
+                if event["type"] != "done":  
+                    yield event  
+            if event["switch_role"]:  
+                self.switch_persona()  
+                reset_history_to_last_question(self.conversation)  
+                async for event in self.agents[self.active_agent].run_stream(self.session_id, self.conversation, prefetch):  
+                    if event["type"] != "done":  
+                        yield event  
+        finally:  
+            # Speculative work the question did not need  
+            cancel_speculative_work()  
+        conversation_store.append_turn(self.session_id, last_turn(self.conversation))  
+        yield {"type": "done", "code": event["code"], "conversation": self.conversation, "content": event["content"], "data": event["data"]}  
   
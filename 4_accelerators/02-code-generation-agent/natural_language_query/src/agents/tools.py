@@ -1,88 +1,174 @@
 import os  
 import json  
-import redis  
 import uuid  
 import pandas as pd  
 from pathlib import Path  
-from sqlalchemy import create_engine  
 from azure.core.credentials import AzureKeyCredential  
-from azure.search.documents import SearchClient  
-from azure.search.documents.models import VectorizedQuery  
+from azure.search.documents.aio import SearchClient  
+import asyncio  
 import contextlib  
+import functools  
 import sys  
+import threading  
 from io import StringIO  
+from concurrent.futures import ThreadPoolExecutor  
 from dotenv import load_dotenv  
-from openai import AzureOpenAI  
+from openai import AsyncAzureOpenAI  
+from openai.types.chat import ChatCompletionMessage  
 from tenacity import retry, wait_random_exponential, stop_after_attempt  
 from plotly.graph_objects import Figure as PlotlyFigure  
 from matplotlib.figure import Figure as MatplotFigure  
 from fastapi import HTTPException
-import base64  
-import pickle  
 import inspect  
-import httpx  # Add this import  
+import re  
+import httpx  
+import base64  
+from .embedding_utils import EmbeddingCache, EmbeddingBatcher  
+from .metadata_index import MetadataIndex  
+from .scenario_router import ScenarioRouter  
+from .semantic_cache import AzureSearchCache, LocalSemanticCache, STOPWORDS  
+from .answer_cache import ExactAnswerCache  
+from utils.codec import Codec  
+from utils.redis_client import create_redis_client  
   
 env_path = Path('./') / 'secrets.env'  
 load_dotenv(dotenv_path=env_path)  
   
-# Redis configuration  
-AZURE_REDIS_ENDPOINT = os.getenv("AZURE_REDIS_ENDPOINT")  
-AZURE_REDIS_KEY = os.getenv("AZURE_REDIS_KEY")  
-redis_client = redis.StrictRedis(host=AZURE_REDIS_ENDPOINT, port=6380, password=AZURE_REDIS_KEY, ssl=True)  
+# Redis configuration, the pooled client reads AZURE_REDIS_ENDPOINT and AZURE_REDIS_KEY  
+redis_client = create_redis_client()  
 PYTHON_SERVICE_URL = os.getenv("PYTHON_SERVICE_URL", "http://localhost:8000")  
+PYTHON_SERVICE_MAX_CONNECTIONS = int(os.getenv("PYTHON_SERVICE_MAX_CONNECTIONS", 20))  
 
-def redis_set(key, value):  
-    redis_client.set(key, base64.b64encode(s=pickle.dumps(obj=value)))  
-  
-def redis_get(key):  
-    value = redis_client.get(key)  
-    return pickle.loads(base64.b64decode(value)) if value else None  
+redis_codec = Codec(compression=os.getenv("REDIS_COMPRESSION", "zstd"), compression_threshold=int(os.getenv("REDIS_COMPRESSION_MIN_BYTES", 1024)))  
   
 # Azure OpenAI configuration  
-client = AzureOpenAI(  
-    api_key=os.environ.get("AZURE_OPENAI_API_KEY"),  
-    api_version=os.getenv("AZURE_OPENAI_API_VERSION"),  
-    azure_endpoint=os.environ.get("AZURE_OPENAI_ENDPOINT"),  
-)  
+def create_openai_client():  
+    return AsyncAzureOpenAI(  
+        api_key=os.environ.get("AZURE_OPENAI_API_KEY"),  
+        api_version=os.getenv("AZURE_OPENAI_API_VERSION"),  
+        azure_endpoint=os.environ.get("AZURE_OPENAI_ENDPOINT"),  
+    )  
+  
+client = create_openai_client()  
 chat_engine2 = os.getenv("AZURE_OPENAI_DEPLOYMENT2")  
 embedding_model = os.getenv("AZURE_OPENAI_EMB_DEPLOYMENT")  
   
-# Azure Search configuration  
-search_service = os.getenv("AZURE_SEARCH_SERVICE_ENDPOINT")  
-service_endpoint = f"https://{search_service}.search.windows.net/"  
-index_name = os.getenv("AZURE_SEARCH_INDEX_NAME")  
-key = os.getenv("AZURE_SEARCH_ADMIN_KEY")  
-credential = AzureKeyCredential(key)  
-azcs_search_client = SearchClient(service_endpoint, index_name=index_name, credential=credential)  
+# Python service client, shared by all tool calls so code executions reuse kept-alive connections instead of  
+# paying TCP and TLS setup each time. The connection limit bounds concurrent calls, further calls wait for a connection.  
+def create_python_service_client():  
+    return httpx.AsyncClient(  
+        base_url=PYTHON_SERVICE_URL,  
+        http2=os.getenv("PYTHON_SERVICE_HTTP2", "false").lower() == "true",  
+        timeout=httpx.Timeout(float(os.getenv("PYTHON_SERVICE_TIMEOUT", 120)), connect=float(os.getenv("PYTHON_SERVICE_CONNECT_TIMEOUT", 5)), pool=None),  
+        limits=httpx.Limits(max_connections=PYTHON_SERVICE_MAX_CONNECTIONS, max_keepalive_connections=PYTHON_SERVICE_MAX_CONNECTIONS, keepalive_expiry=float(os.getenv("PYTHON_SERVICE_KEEPALIVE_EXPIRY", 60))),  
+    )  
+  
+python_service_client = create_python_service_client()  
+  
+# Semantic cache of answered questions: the Azure AI Search index, or a local SQLite file with SEMANTIC_CACHE_BACKEND=local  
+def create_semantic_cache():  
+    if os.getenv("SEMANTIC_CACHE_BACKEND", "azure_search").lower() == "local":  
+        return LocalSemanticCache(  
+            os.getenv("SEMANTIC_CACHE_PATH", "data/semantic_cache.db"),  
+            max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 10000)),  
+            dedup_threshold=float(os.getenv("SEMANTIC_CACHE_DEDUP_THRESHOLD", 0.97)),  
+        )  
+    search_service = os.getenv("AZURE_SEARCH_SERVICE_ENDPOINT")  
+    service_endpoint = f"https://{search_service}.search.windows.net/"  
+    index_name = os.getenv("AZURE_SEARCH_INDEX_NAME")  
+    credential = AzureKeyCredential(os.getenv("AZURE_SEARCH_ADMIN_KEY"))  
+    return AzureSearchCache(SearchClient(service_endpoint, index_name=index_name, credential=credential))  
+  
+semantic_cache = create_semantic_cache()  
   
-sqllite_db_path = os.environ.get("SQLITE_DB_PATH", "../../data/northwind.db")  
-engine = create_engine(f'sqlite:///{sqllite_db_path}')  
+# Exact repeats of approved questions are answered from Redis while the data they were computed on is unchanged  
+exact_answer_cache = ExactAnswerCache(  
+    redis_client,  
+    redis_codec,  
+    ttl=int(os.getenv("EXACT_ANSWER_CACHE_TTL")) if os.getenv("EXACT_ANSWER_CACHE_TTL") else None,  
+    max_payload_bytes=int(os.getenv("EXACT_ANSWER_CACHE_MAX_PAYLOAD_MB", 5)) * 1024 * 1024,  
+) if os.getenv("EXACT_ANSWER_CACHE", "true").lower() == "true" else None  
   
-def get_embedding(text):  
+# Embedding cache, the Redis tier is shared by all app instances when EMBEDDING_CACHE_REDIS is enabled  
+embedding_cache = EmbeddingCache(  
+    max_size=int(os.getenv("EMBEDDING_CACHE_SIZE", 10000)),  
+    ttl=float(os.getenv("EMBEDDING_CACHE_TTL", 86400)),  
+    redis_client=redis_client if os.getenv("EMBEDDING_CACHE_REDIS", "false").lower() == "true" else None,  
+)  
+# Concurrent sessions share embedding requests instead of sending one single-item request each.  
+# The batcher runs on its own event loop, so it gets its own client.  
+embedding_batcher = EmbeddingBatcher(  
+    create_openai_client(),  
+    model=embedding_model,  
+    max_batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", 64)),  
+    max_wait=float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", 5)) / 1000,  
+)  
+  
+# The async clients above keep their connection pools bound to one event loop. Streamlit runs every script  
+# rerun in its own thread, so all agent coroutines are run on one process-wide loop instead of asyncio.run,  
+# which also lets the conversations of concurrent sessions overlap while they wait on the network.  
+agent_loop = None  
+agent_loop_lock = threading.Lock()  
+  
+def run_async(coro):  
+    global agent_loop  
+    with agent_loop_lock:  
+        if agent_loop is None:  
+            agent_loop = asyncio.new_event_loop()  
+            threading.Thread(target=agent_loop.run_forever, name="agent-loop", daemon=True).start()  
+    return asyncio.run_coroutine_threadsafe(coro, agent_loop).result()  
+  
+async def get_embedding(text):  
     text = text.replace("\n", " ")  
-    return client.embeddings.create(input=[text], model=embedding_model).data[0].embedding  
-  
-def add_to_cache(question, code, answer):  
-    experience = {  
-        "id": str(uuid.uuid4()),  
-        "question": question,  
-        "code": code,  
-        "questionVector": get_embedding(question),  
-        "answer": answer  
-    }  
-    azcs_search_client.upload_documents(documents=[experience])  
-  
-def get_cache(question):  
-    vector = VectorizedQuery(vector=get_embedding(question), k_nearest_neighbors=3, fields="questionVector")  
-    results = azcs_search_client.search(  
-        search_text=question,  
-        vector_queries=[vector],  
-        select=["question", "code", "answer"],  
-        top=2  
-    )  
+    return await embedding_cache.aget_or_compute(embedding_model, text, lambda: embedding_batcher.embed(text))  
+  
+async def data_version():  
+    # DATA_VERSION overrides the version of the database the python service queries, None when it cannot be read  
+    if os.getenv("DATA_VERSION"):  
+        return os.getenv("DATA_VERSION")  
+    try:  
+        response = await python_service_client.get("/data_version/")  
+        response.raise_for_status()  
+        return response.json()["data_version"]  
+    except httpx.HTTPError as e:  
+        print("reading the data version failed: ", e)  
+        return None  
+  
+async def add_to_cache(question, code, answer, data=None):  
+    await semantic_cache.add(question, code, answer, await get_embedding(question))  
+    if exact_answer_cache is not None:  
+        version = await data_version()  
+        if version is not None:  
+            exact_answer_cache.set(question, code, answer, data, version)  
+  
+async def get_cached_answer(question, session_id):  
+    # The approved answer of the same question on the current data, with the data it showed, or None  
+    if exact_answer_cache is None:  
+        return None  
+    version = await data_version()  
+    if version is None:  
+        return None  
+    cached_answer = exact_answer_cache.get(question, version)  
+    if cached_answer is None or not cached_answer["has_data"] or cached_answer["data"] is not None or not cached_answer["code"]:  
+        return cached_answer  
+    # The shown data was too large to store, replaying the code regenerates it  
+    try:  
+        result = await execute_python_code("Replay of an approved solution", cached_answer["question"], cached_answer["code"], session_id)  
+    except Exception as e:  
+        print("replay of the cached solution failed: ", e)  
+        return None  
+    if result["data"] is None:  
+        # Errors, timeouts and crashes of the replay show nothing, the agent answers the question instead  
+        print("replay of the cached solution showed no data: ", result["output"])  
+        return None  
+    cached_answer["data"] = result["data"]  
+    return cached_answer  
+  
+async def get_cache(question):  
+    results = await semantic_cache.search(question, await get_embedding(question), top=2)  
     text_content = ""  
     for result in results:  
-        if result['@search.score'] >= float(os.getenv("SEMANTIC_HIT_THRESHOLD")):  
+        if result['score'] >= float(os.getenv("SEMANTIC_HIT_THRESHOLD")):  
             text_content += f"###Question: {result['question']}\n###Solution:\n {result['code']}\n"  
     return text_content  
   
@@ -98,6 +184,43 @@ def check_args(function, args):
         if param.default is param.empty and name not in args:  
             return False  
   
+def iterate_async(async_iterator):  
+    # Consumes an async generator from sync code (e.g. st.write_stream), one step at a time on the agent loop  
+    while True:  
+        try:  
+            yield run_async(async_iterator.__anext__())  
+        except StopAsyncIteration:  
+            return  
+  
+async def stream_chat_completion(client, **kwargs):  
+    # Streams a chat completion, yields ("token", text) for each content delta and finally ("message", message)  
+    # with the tool call deltas assembled into a regular assistant message  
+    content = ""  
+    tool_calls = {}  
+    async for chunk in await client.chat.completions.create(stream=True, **kwargs):  
+        if not chunk.choices:  # Azure sends content filter results in chunks without choices  
+            continue  
+        delta = chunk.choices[0].delta  
+        if delta.content:  
+            content += delta.content  
+            yield "token", delta.content  
+        for tool_call_delta in delta.tool_calls or []:  
+            tool_call = tool_calls.setdefault(tool_call_delta.index, {"id": None, "type": "function", "function": {"name": "", "arguments": ""}})  
+            if tool_call_delta.id:  
+                tool_call["id"] = tool_call_delta.id  
+            if tool_call_delta.function is not None:  
+                tool_call["function"]["name"] += tool_call_delta.function.name or ""  
+                tool_call["function"]["arguments"] += tool_call_delta.function.arguments or ""  
+    yield "message", ChatCompletionMessage(role="assistant", content=content, tool_calls=[tool_calls[index] for index in sorted(tool_calls)] or None)  
+  
+# Sync tools run in this bounded pool so that they do not block the agent loop  
+tool_executor = ThreadPoolExecutor(max_workers=int(os.getenv("TOOL_MAX_WORKERS", 8)))  
+  
+async def call_tool(function_to_call, function_args):  
+    if inspect.iscoroutinefunction(function_to_call):  
+        return await function_to_call(**function_args)  
+    return await asyncio.get_running_loop().run_in_executor(tool_executor, functools.partial(function_to_call, **function_args))  
+  
 def transform_tools(tools):  
     transformed_tools = []  
     for tool in tools:  
@@ -113,8 +236,6 @@ def transform_tools(tools):
     return transformed_tools  
   
 async def execute_python_code(assumptions, goal, python_code, session_id):  
-    url = f"{PYTHON_SERVICE_URL}/execute/"  # Change this if your FastAPI service is running on a different host/port  
-    print("url ", url)
     payload = {  
         "assumptions": assumptions,  
         "goal": goal,  
@@ -122,37 +243,36 @@ async def execute_python_code(assumptions, goal, python_code, session_id):
         "session_id": session_id  
     }  
   
-    async with httpx.AsyncClient() as client:  
-        response = await client.post(url, json=payload)  
-        if response.status_code == 200:  
-            result = response.json()  
-            print("result of python code execution ", result)
-            return result["output"]  
-        else:  
-            raise HTTPException(status_code=response.status_code, detail=response.text)  
+    response = await python_service_client.post("/execute/", json=payload)  
+    if response.status_code == 200:  
+        result = response.json()  
+        print("result of python code execution ", result["output"])
+        # The data passed to show_to_user comes back with the response, no Redis read needed  
+        data = redis_codec.decode(base64.b64decode(result["data"])) if result.get("data") else None  
+        return {"output": result["output"], "data": data}  
+    else:  
+        raise HTTPException(status_code=response.status_code, detail=response.text)  
   
 def get_additional_context():  
     pass  
   
-@retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6))  
-def retrieve_context(business_concepts):  
-    # Load the metadata file  
-    with open(os.getenv("META_DATA_FILE", "data/metadata.json"), "r") as file:  
-        data = json.load(file)  
-    # Extract values from the loaded data  
-    analytic_scenarios = data.get("analytic_scenarios", {})  
-    scenario_list = [(scenario[0], scenario[1]['description']) for scenario in analytic_scenarios.items()]  
-    # create scenario_list_md which is the a markdown table with column headers 'Scenario' and 'Description' from scenario_list  
-    scenario_list_md = ""  
-    for scenario in scenario_list:  
-        scenario_list_md += f"| {scenario[0]} | {scenario[1]} |\n"  
-    # add headers 'Scenario' and 'Description' to scenario_list_md  
-    scenario_list_md = f"| Scenario | Description |\n| --- | --- |\n{scenario_list_md}"  
+# Parsed once, and again only when the file changes  
+metadata_index = MetadataIndex(os.getenv("META_DATA_FILE", "data/metadata.json"))  
+  
+# Answers clearly matched business concepts by embedding similarity, the completion below only handles the rest.  
+# Off unless SCENARIO_ROUTER=true, tune the margin with utils/evaluate_scenario_router.py before enabling it  
+scenario_router = ScenarioRouter(  
+    get_embedding,  
+    margin=float(os.getenv("SCENARIO_ROUTER_MARGIN", 0.05)),  
+    min_score=float(os.getenv("SCENARIO_ROUTER_MIN_SCORE", 0.0)),  
+) if os.getenv("SCENARIO_ROUTER", "false").lower() == "true" else None  
+  
+async def route_scenarios_with_model(metadata, business_concepts):  
     sys_msg = f"""  
     You are an AI assistant that helps people find information.  
     You are given business concept(s) and you need to identify which one or several business analytic scenario(s) below are relevant to the them.  
     <<analytic_scenarios>>  
-    {scenario_list_md}  
+    {metadata.scenario_list_md}  
     <</analytic_scenarios>>  
     Output your response in json format with the following structure:  
        {{  
@@ -163,39 +283,68 @@ def retrieve_context(business_concepts):
         ]  
     }}  
     """  
-    response = client.chat.completions.create(  
+    response = await client.chat.completions.create(  
         model=chat_engine2,  # The deployment name you chose when you deployed the GPT-35-turbo or GPT-4 model.  
         messages=[{"role": "system", "content": sys_msg}, {"role": "user", "content": business_concepts}],  
         response_format={"type": "json_object"}  
     )  
     response_message = response.choices[0].message.content.strip()  
     scenario_names = json.loads(response_message)["scenarios"]  
-    scenario_names = [scenario["scenario_name"] for scenario in scenario_names]  
-    # Extract values from the loaded data  
-    analytic_scenarios = data.get("analytic_scenarios", {})  
-    scenario_list = [scenario[0] for scenario in analytic_scenarios.items()]  
-    if not set(scenario_names).issubset(set(scenario_list)):  
+    return [scenario["scenario_name"] for scenario in scenario_names]  
+  
+async def retrieve_context_once(business_concepts):  
+    # One attempt of retrieve_context, without retries  
+    metadata = metadata_index.current()  
+    scenario_names = None  
+    if scenario_router is not None:  
+        try:  
+            scenario_names = await scenario_router.route(metadata, business_concepts)  
+        except Exception as e:  
+            print("scenario router failed, asking the model: ", e)  
+    if scenario_names is None:  
+        scenario_names = await route_scenarios_with_model(metadata, business_concepts)  
+    if not set(scenario_names).issubset(metadata.scenarios):  
         raise Exception("You provided invalid scenario name(s), please check and try again")  
-    scenario_tables = data.get("scenario_tables", {})  
-    scenario_context = "Following tables might be relevant to the question: \n"  
-    all_tables = data.get("tables", {})  
-    all_relationships = data.get("table_relationships", {})  
-    all_relationships = {(relationship[0], relationship[1]): relationship[2] for relationship in all_relationships}  
-    tables = set()  
-    for scenario_name in scenario_names:  
-        tables.update(scenario_tables.get(scenario_name, []))  
-    for table in tables:  
-        scenario_context += f"- table_name: {table} - description: {all_tables[table]['description']} - columns: {all_tables[table]['columns']}\n"  
-    table_pairs = [(table1, table2) for table1 in tables for table2 in tables if table1 != table2]  
-    relationships = set()  
-    for table_pair in table_pairs:  
-        relationship = all_relationships.get(table_pair, None)  
-        if relationship:  
-            relationships.add((table_pair[0], table_pair[1], relationship))  
-    scenario_context += "\nTable relationships: \n"  
-    for relationship in relationships:  
-        scenario_context += f"- {relationship[0]}, {relationship[1]}:{relationship[2]}\n"  
-    scenario_context += "\nFollowing rules might be relevant: \n"  
-    for scenario_name in scenario_names:  
-        scenario_context += f"- {scenario_name}: {str(analytic_scenarios[scenario_name]['rules'])}\n"  
-    return scenario_context  
+    return metadata.context(scenario_names)  
+  
+@retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6))  
+async def retrieve_context(business_concepts):  
+    return await retrieve_context_once(business_concepts)  
+  
+def concept_words(text):  
+    # Content words with a plural s removed, "top customers" and "Who is the top customer?" share {"top", "customer"}  
+    return {word[:-1] if word.endswith("s") and len(word) > 3 else word for word in re.findall(r"\w+", text.lower()) if word not in STOPWORDS}  
+  
+class ContextPrefetch():  
+    """  
+    Context retrieval for the raw question, started once the question goes to an agent that can call  
+    retrieve_context, so that it runs while the model decides to call it.  
+  
+    The prefetch is a single attempt. When the model then asks for business concepts that are all words of the  
+    question, the prefetched context answers the call, and a failed prefetch is retried there; other concepts are  
+    retrieved as usual. Call cancel() once the question is answered to stop a retrieval nobody asked for.  
+  
+    Args:  
+        question (str): the user's question.  
+    """  
+    def __init__(self, question):  
+        self.question_words = concept_words(question)  
+        self.task = asyncio.create_task(retrieve_context_once(question))  
+        # A failed or cancelled prefetch nobody waited for is not an error worth logging  
+        self.task.add_done_callback(lambda task: task.cancelled() or task.exception())  
+        self.hits = 0  
+  
+    def covers(self, business_concepts):  
+        return concept_words(business_concepts) <= self.question_words  
+  
+    async def retrieve_context(self, business_concepts):  
+        try:  
+            context = await asyncio.shield(self.task)  
+            self.hits += 1  
+            return context  
+        except Exception as e:  
+            print("prefetched context failed, retrieving it again: ", e)  
+            return await retrieve_context(business_concepts)  
+  
+    def cancel(self):  
+        self.task.cancel()  
@@ -0,0 +1,432 @@
+import os
+import sys
+import json
+import asyncio
+import base64
+import signal
+import contextlib
+import multiprocessing
+import time
+from collections import OrderedDict
+from io import StringIO
+
+from utils.codec import Codec
+from utils.redis_client import create_redis_client
+from utils.sqlite_engine import analytics_engine
+from api.sql_cache import SqlResultCache, database_version
+
+try:
+    import resource  # CPU and memory limits are only available on Unix
+except ImportError:
+    resource = None
+
+
+class CpuTimeExceeded(BaseException):
+    # Not an Exception, like KeyboardInterrupt, so a bare "except Exception" in the generated code cannot swallow it
+    pass
+
+
+# Worker process side. Everything below up to SandboxWorker runs inside the pre-warmed worker processes.
+
+def _raise_cpu_time_exceeded(signum, frame):
+    raise CpuTimeExceeded("The code exceeded its CPU time limit")
+
+def _set_cpu_time_limit(seconds):
+    if resource is None or not seconds:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime + seconds) + 1
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+def _clear_cpu_time_limit():
+    if resource is None:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+
+def _set_memory_limit(megabytes):
+    if resource is None or not megabytes:
+        return
+    limit = megabytes * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+@contextlib.contextmanager
+def captured_output():
+    # Redirecting the process-wide streams is safe here because a worker runs one request at a time
+    new_out, new_err = StringIO(), StringIO()
+    old_out, old_err = sys.stdout, sys.stderr
+    try:
+        sys.stdout, sys.stderr = new_out, new_err
+        yield sys.stdout, sys.stderr
+    finally:
+        sys.stdout, sys.stderr = old_out, old_err
+
+class CodeRunner:
+    """
+    Runs the generated python code of /execute/ requests with the utility functions the agent prompt describes.
+    One instance lives in each worker process, created after the heavy imports so every request starts warm.
+
+    Every session gets its own namespace that is kept between requests, so corrected or follow-up code can reuse the
+    dataframes of the previous call instead of querying the database again. Namespaces idle for longer than session_ttl
+    are dropped, and the least recently used ones are dropped while all namespaces together hold more than
+    namespace_memory_mb.
+    """
+    def __init__(self, session_ttl=600, namespace_memory_mb=512):
+        self.session_ttl = session_ttl
+        self.namespace_memory_limit = namespace_memory_mb * 1024 * 1024
+        self.namespaces = OrderedDict()  # session_id -> (last_used, namespace), least recently used first
+        import pandas as pd
+        from plotly.graph_objects import Figure as PlotlyFigure
+        from matplotlib.figure import Figure as MatplotFigure
+        import plotly.express  # noqa: F401 pre-imported for the generated code
+        import numpy as np
+
+        self.pd = pd
+        self.np = np
+        self.figure_types = (PlotlyFigure, MatplotFigure)
+        # Redis configuration, only the shared tier of the SQL result cache uses it
+        sql_cache_redis = os.getenv("SQL_CACHE_REDIS", "false").lower() == "true"
+        self.redis_client = create_redis_client(max_connections=2) if sql_cache_redis else None  # a worker runs one request at a time
+        self.redis_codec = Codec(compression=os.getenv("REDIS_COMPRESSION", "zstd"), compression_threshold=int(os.getenv("REDIS_COMPRESSION_MIN_BYTES", 1024)))
+        # SQLAlchemy configuration
+        self.sqllite_db_path = os.environ.get("SQLITE_DB_PATH", "data/northwind.db")
+        self.engine = analytics_engine(self.sqllite_db_path, pool_size=2)  # a chunked query can hold one connection while another runs
+        # Query results are cached per worker, and in Redis for all workers when SQL_CACHE_REDIS is enabled
+        self.sql_cache = SqlResultCache(
+            max_bytes=int(os.getenv("SQL_CACHE_MAX_MB", 256)) * 1024 * 1024,
+            redis_client=self.redis_client,
+            codec=self.redis_codec,
+            ttl=int(os.getenv("SQL_CACHE_TTL", 3600)),
+        )
+        self.max_rows = int(os.getenv("SQL_MAX_ROWS", 100000))
+        self._date_columns = None  # (database version, date columns, all columns) of the schema
+        self.display = None  # (data, text) of the last show_to_user call of the running request
+        self.notes = []  # notes for the model about the running request, added to its output
+
+    def execute_sql_query(self, sql_query, limit=None, chunksize=None):
+        # limit caps the rows that are fetched, by default at SQL_MAX_ROWS. With chunksize the result is an iterator
+        # of dataframes of that many rows, so large tables can be aggregated in bounded memory.
+        if chunksize is not None:
+            return (self.convert_types(chunk) for chunk in self.pd.read_sql_query(sql_query, self.engine, chunksize=chunksize))
+        row_limit = self.max_rows if limit is None else limit
+        result = self.sql_cache.get_or_compute(self.sqllite_db_path, sql_query, lambda: self.read_sql_query(sql_query, row_limit), variant=f"limit={row_limit}")
+        if limit is None and result.attrs.get("truncated"):
+            self.notes.append(f"Note: the query result was truncated to its first {row_limit} rows, aggregate in SQL or use execute_sql_query(sql_query, chunksize=...) to process all rows.")
+        return result
+
+    def read_sql_query(self, sql_query, limit):
+        # Rows beyond the limit are never fetched from the cursor, one extra row tells whether the result was cut
+        with self.engine.connect() as connection:
+            cursor_result = connection.exec_driver_sql(sql_query)
+            columns = list(cursor_result.keys())
+            rows = cursor_result.fetchmany(limit + 1)
+        result = self.convert_types(self.pd.DataFrame.from_records(rows[:limit], columns=columns, coerce_float=True))
+        result.attrs["truncated"] = len(rows) > limit
+        return result
+
+    def date_columns(self):
+        # Names of the columns declared as DATE, DATETIME or TIMESTAMP in the database schema, reloaded when the database changes
+        version = database_version(self.sqllite_db_path)
+        if self._date_columns is None or self._date_columns[0] != version:
+            date_columns, known_columns = set(), set()
+            with self.engine.connect() as connection:
+                tables = [row[0] for row in connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")]
+                for table in tables:
+                    for row in connection.exec_driver_sql(f'PRAGMA table_info("{table}")'):
+                        known_columns.add(row[1].lower())
+                        if any(date_type in (row[2] or "").upper() for date_type in ("DATE", "TIME")):
+                            date_columns.add(row[1].lower())
+            self._date_columns = (version, date_columns, known_columns)
+        return self._date_columns[1], self._date_columns[2]
+
+    def convert_types(self, result):
+        # Dates are parsed once per column: columns declared as dates in the schema, and computed columns whose name says date
+        pd = self.pd
+        result = result.infer_objects()
+        date_columns, known_columns = self.date_columns()
+        for col in result.columns:
+            name = str(col).lower()
+            if name in date_columns or (name not in known_columns and 'date' in name):
+                if pd.api.types.is_object_dtype(result[col]) or pd.api.types.is_string_dtype(result[col]):
+                    try:
+                        result[col] = pd.to_datetime(result[col], format="ISO8601")
+                    except (ValueError, TypeError):
+                        pass
+        return result
+
+    def reduce_dataframe_size(self, df):
+        # Text columns are cut to max_str_length with vectorized string operations, only cells that look like
+        # JSON lists or objects are parsed to shorten their lists
+        pd = self.pd
+        max_str_length = 100
+        max_list_length = 3
+        reduced_df = df.copy()
+        for column in df.columns:
+            if pd.api.types.is_object_dtype(df[column]) or pd.api.types.is_string_dtype(df[column]):
+                text = df[column].astype(object).astype(str)
+                looks_like_json = text.str.lstrip().str[:1].isin(["[", "{"])
+                reduced = text.str.slice(0, max_str_length)
+                if looks_like_json.any():
+                    reduced[looks_like_json] = text[looks_like_json].map(lambda x: self.reduce_cell(x, max_str_length, max_list_length))
+                reduced_df[column] = reduced
+        return reduced_df
+
+    def reduce_cell(self, cell, max_str_length, max_list_length):
+        try:
+            data = json.loads(cell)
+            if isinstance(data, list):
+                data = self.truncate_list(data, max_list_length)
+            return json.dumps(data)
+        except (json.JSONDecodeError, TypeError):
+            return str(cell)[:max_str_length]
+
+    def truncate_list(self, lst, max_list_length):
+        truncated = lst[:max_list_length]
+        for i, item in enumerate(truncated):
+            if isinstance(item, dict):
+                truncated[i] = self.truncate_dict(item, max_list_length)
+            elif isinstance(item, list):
+                truncated[i] = self.truncate_list(item, max_list_length)
+        return truncated
+
+    def truncate_dict(self, dct, max_list_length):
+        for key, value in dct.items():
+            if isinstance(value, list):
+                dct[key] = self.truncate_list(value, max_list_length)
+            elif isinstance(value, dict):
+                dct[key] = self.truncate_dict(value, max_list_length)
+        return dct
+
+    def show_to_user(self, data):
+        if type(data) in self.figure_types:
+            text = None
+        elif type(data) is self.pd.DataFrame:
+            text = self.reduce_dataframe_size(data.head(30)).to_markdown(index=False, disable_numparse=True)
+        else:
+            text = str(data)
+        self.display = (data, text)
+
+    def encode_display_data(self, data):
+        # The shown data is only returned in the response, the client decodes it there
+        return base64.b64encode(self.redis_codec.encode(data)).decode("ascii")
+
+    def get_namespace(self, session_id):
+        now = time.monotonic()
+        for idle_session_id in [key for key, (last_used, _) in self.namespaces.items() if now - last_used > self.session_ttl]:
+            del self.namespaces[idle_session_id]
+        _, namespace = self.namespaces.pop(session_id, (None, {}))
+        self.namespaces[session_id] = (now, namespace)
+        return namespace
+
+    def object_size(self, value):
+        if isinstance(value, self.pd.DataFrame):
+            return int(value.memory_usage(deep=True).sum())
+        if isinstance(value, self.pd.Series):
+            return int(value.memory_usage(deep=True))
+        if isinstance(value, self.np.ndarray):
+            return value.nbytes
+        return sys.getsizeof(value)
+
+    def namespace_size(self, namespace):
+        return sum(self.object_size(value) for name, value in namespace.items() if not name.startswith('__') and not callable(value))
+
+    def enforce_memory_limit(self):
+        total = sum(self.namespace_size(namespace) for _, namespace in self.namespaces.values())
+        while total > self.namespace_memory_limit and self.namespaces:
+            _, (_, namespace) = self.namespaces.popitem(last=False)
+            total -= self.namespace_size(namespace)
+
+    def run(self, request, cpu_time_limit):
+        session_id = request["session_id"]
+        execution_context = self.get_namespace(session_id)
+        execution_context['execute_sql_query'] = self.execute_sql_query
+        execution_context['show_to_user'] = self.show_to_user
+        self.display = None
+        self.notes = []
+
+        # Use the context manager to capture output
+        with captured_output() as (out, err):
+            try:
+                _set_cpu_time_limit(cpu_time_limit)
+                exec(request["python_code"], execution_context)
+            except (Exception, CpuTimeExceeded) as e:
+                if hasattr(e, 'message'):
+                    print(f"{type(e)}: {e.message}", file=sys.stderr)
+                else:
+                    print(f"{type(e)}: {e}", file=sys.stderr)
+            finally:
+                _clear_cpu_time_limit()
+        self.enforce_memory_limit()
+
+        # Retrieve the captured output and errors
+        stdout = out.getvalue()
+        stderr = err.getvalue()
+        new_input = ""
+        display_data, display_text = self.display if self.display is not None else (None, None)
+        encoded_data = self.encode_display_data(display_data) if self.display is not None else None
+        notes = "".join("\n" + note for note in self.notes)
+
+        if len(stdout) > 0:
+            new_input += "\n" + stdout + notes
+            return {"output": new_input, "data": encoded_data}
+
+        if len(stderr) > 0:
+            new_input += "\n" + stderr
+            return {"output": new_input, "data": encoded_data}
+
+        if display_text:
+            return {"output": display_text + notes, "data": encoded_data}
+
+        return {"output": "The graph for the data was displayed to the user." + notes, "data": encoded_data}
+
+    def stats(self):
+        return {"pid": os.getpid(), "sessions": len(self.namespaces), "sql_cache": self.sql_cache.stats()}
+
+def worker_main(conn, settings):
+    # Entry point of a worker process: import once, then serve requests from the pipe until it is closed
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # shutdown is driven by the parent
+    if hasattr(signal, "SIGXCPU"):
+        signal.signal(signal.SIGXCPU, _raise_cpu_time_exceeded)
+    _set_memory_limit(settings["memory_limit_mb"])
+    runner = CodeRunner(settings["session_ttl"], settings["namespace_memory_mb"])
+    conn.send("ready")
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if request.get("command") == "stats":
+            conn.send(runner.stats())
+            continue
+        try:
+            response = runner.run(request, settings["cpu_time_limit"])
+        except (Exception, CpuTimeExceeded) as e:
+            response = {"output": f"{type(e)}: {e}"}
+        conn.send(response)
+
+
+# Service side
+
+class SandboxWorker:
+    # One worker slot of the pool. The process behind it is replaced on restart, the lock that serializes its requests stays.
+    def __init__(self, context, settings):
+        self.context = context
+        self.settings = settings
+        self.lock = asyncio.Lock()
+        self.start()
+
+    def start(self):
+        self.conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(target=worker_main, args=(child_conn, self.settings), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+
+    def wait_ready(self):
+        # Imports in a new worker do not count against the timeout of the request that waits for it
+        if not self.ready:
+            self.conn.recv()
+            self.ready = True
+
+    def roundtrip(self, request):
+        self.conn.send(request)
+        return self.conn.recv()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def restart(self):
+        self.kill()
+        self.start()
+
+class SandboxPool:
+    """
+    Pool of pre-warmed worker processes that execute the generated code of /execute/ requests.
+
+    Code executions run in parallel, never share captured output, and never block the service's event loop.
+    Requests of a session stick to the worker that holds the session's namespace; a new session goes to the worker
+    with the fewest sessions, preferring idle ones. A worker that exceeds the wall-clock timeout is killed and restarted,
+    which loses the namespaces it held.
+
+    Args:
+        size (int): number of worker processes.
+        timeout (float): wall-clock seconds a request may take.
+        cpu_time_limit (int): CPU seconds a request may use, enforced inside the worker.
+        memory_limit_mb (int): address space limit of each worker, 0 for no limit.
+        session_ttl (float): seconds a session's namespace is kept after its last request.
+        namespace_memory_mb (int): memory the namespaces of one worker may hold together.
+    """
+    def __init__(self, size, timeout=60, cpu_time_limit=30, memory_limit_mb=0, session_ttl=600, namespace_memory_mb=512):
+        self.size = size
+        self.timeout = timeout
+        self.session_ttl = session_ttl
+        self.settings = {
+            "cpu_time_limit": cpu_time_limit,
+            "memory_limit_mb": memory_limit_mb,
+            "session_ttl": session_ttl,
+            "namespace_memory_mb": namespace_memory_mb,
+        }
+        # spawn gives every worker a clean interpreter instead of a fork of the running event loop
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = []
+        self.sessions = {}  # session_id -> (worker, last_used)
+
+    def start(self):
+        self.workers = [SandboxWorker(self.context, self.settings) for _ in range(self.size)]
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.kill()
+        self.workers = []
+        self.sessions = {}
+
+    def _route(self, session_id):
+        now = time.monotonic()
+        self.sessions = {key: value for key, value in self.sessions.items() if now - value[1] <= self.session_ttl}
+        worker = self.sessions.get(session_id, (None, None))[0]
+        if worker is None:
+            session_counts = {id(worker): 0 for worker in self.workers}
+            for assigned_worker, _ in self.sessions.values():
+                session_counts[id(assigned_worker)] += 1
+            worker = min(self.workers, key=lambda worker: (worker.lock.locked(), session_counts[id(worker)]))
+        self.sessions[session_id] = (worker, now)
+        return worker
+
+    def _restart(self, worker):
+        worker.restart()
+        self.sessions = {key: value for key, value in self.sessions.items() if value[0] is not worker}
+
+    async def stats(self):
+        # Statistics of every worker, a busy worker answers after its current request
+        loop = asyncio.get_running_loop()
+        worker_stats = []
+        for worker in self.workers:
+            async with worker.lock:
+                try:
+                    await loop.run_in_executor(None, worker.wait_ready)
+                    worker_stats.append(await loop.run_in_executor(None, worker.roundtrip, {"command": "stats"}))
+                except (EOFError, OSError):
+                    worker_stats.append({"error": "worker unavailable"})
+        return worker_stats
+
+    async def execute(self, request):
+        worker = self._route(request["session_id"])
+        loop = asyncio.get_running_loop()
+        async with worker.lock:
+            try:
+                await loop.run_in_executor(None, worker.wait_ready)
+                response = await asyncio.wait_for(loop.run_in_executor(None, worker.roundtrip, request), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                self._restart(worker)
+                response = {"output": f"The code did not finish within {self.timeout} seconds and was stopped, please make it more efficient."}
+            except (EOFError, OSError):
+                # The worker died, e.g. killed by the hard CPU limit
+                self._restart(worker)
+                response = {"output": "The code crashed the python environment, please check it and try again."}
+        self.sessions[request["session_id"]] = (worker, time.monotonic())
+        return response
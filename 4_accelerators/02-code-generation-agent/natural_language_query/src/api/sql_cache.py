@@ -0,0 +1,152 @@
+# Result cache of execute_sql_query, used by the sandbox workers.
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+def normalize_sql(sql_query):
+    # Whitespace outside of string literals and a trailing semicolon do not change the result
+    parts = []
+    quote = None
+    pending_space = False
+    for char in sql_query.strip().rstrip(";").strip():
+        if quote is not None:
+            parts.append(char)
+            if char == quote:
+                quote = None
+        elif char.isspace():
+            pending_space = True
+        else:
+            if pending_space and parts:
+                parts.append(" ")
+            pending_space = False
+            parts.append(char)
+            if char in ("'", '"', "`", "["):
+                quote = "]" if char == "[" else char
+    return "".join(parts)
+
+def is_cacheable(sql_query):
+    # Only plain reads without time or randomness dependent functions return the same result for the same data
+    normalized = normalize_sql(sql_query).lower()
+    return normalized.startswith(("select", "with")) and not any(token in normalized for token in ("random(", "'now'", "current_"))
+
+def database_version(db_path):
+    # Any committed write changes the size or modification time of the database file or of its WAL file
+    version = []
+    for path in (db_path, db_path + "-wal"):
+        try:
+            stat = os.stat(path)
+            version.append(f"{stat.st_mtime_ns}:{stat.st_size}")
+        except FileNotFoundError:
+            version.append("-")
+    return "/".join(version)
+
+def dataframe_size(df):
+    return int(df.memory_usage(deep=True).sum())
+
+class SqlResultCache():
+    """
+    Cache of query results keyed by normalized SQL and database file version, so a change to the database
+    invalidates every entry of the old version.
+
+    The first tier is an in-process LRU bounded by the memory of the cached dataframes. The optional second tier is
+    a Redis client shared by all workers and service instances, where results are stored with the codec (Arrow IPC).
+    Cached dataframes are copied on the way out, so code that modifies a result does not modify the cache.
+
+    Args:
+        max_bytes (int): memory the cached dataframes of this process may use.
+        redis_client: optional Redis client for the shared tier.
+        codec: codec of the shared tier, see utils/codec.py.
+        ttl (int): seconds results are kept in Redis.
+        key_prefix (str): prefix of the Redis keys.
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024, redis_client=None, codec=None, ttl=3600, key_prefix="sql:"):
+        self.max_bytes = max_bytes
+        self.redis_client = redis_client
+        self.codec = codec
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+        self._entries = OrderedDict()  # key -> (size, dataframe)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _key(self, db_path, sql_query, variant):
+        return hashlib.sha256(f"{database_version(db_path)}\0{normalize_sql(sql_query)}\0{variant}".encode("utf-8")).hexdigest()
+
+    def _set_local(self, key, df):
+        size = dataframe_size(df)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[0]
+            self._entries[key] = (size, df)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                evicted_size, _ = self._entries.popitem(last=False)[1]
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def get(self, db_path, sql_query, variant=""):
+        key = self._key(db_path, sql_query, variant)
+        df = self._get_local(key)
+        if df is not None:
+            self.hits += 1
+            return df.copy()
+        if self.redis_client is not None:
+            try:
+                value = self.redis_client.get(self.key_prefix + key)
+            except Exception as e:
+                print("sql cache redis read failed: ", e)
+                value = None
+            if value is not None:
+                df = self.codec.decode(value)
+                self._set_local(key, df)
+                self.redis_hits += 1
+                return df.copy()
+        self.misses += 1
+        return None
+
+    def set(self, db_path, sql_query, df, variant=""):
+        key = self._key(db_path, sql_query, variant)
+        self._set_local(key, df.copy())
+        if self.redis_client is not None:
+            try:
+                self.redis_client.set(self.key_prefix + key, self.codec.encode(df), ex=self.ttl)
+            except Exception as e:
+                print("sql cache redis write failed: ", e)
+
+    def get_or_compute(self, db_path, sql_query, compute, variant=""):
+        # variant tells apart results of the same query read with different options, e.g. a row limit
+        if not is_cacheable(sql_query):
+            return compute()
+        df = self.get(db_path, sql_query, variant)
+        if df is None:
+            df = compute()
+            self.set(db_path, sql_query, df, variant)
+        return df
+
+    def stats(self):
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.redis_hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+        }
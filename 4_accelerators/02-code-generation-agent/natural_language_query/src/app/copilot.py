@@ -4,14 +4,14 @@ import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))  
 from agents.smart_agent import  Agent_Orchestrator  
-from agents.tools import add_to_cache, redis_get, redis_set  
+from agents.tools import add_to_cache, run_async, iterate_async  
+from app.streamlit_utils import stream_agent_response  
 import os  
 import json  
 import uuid  
 from plotly.graph_objects import Figure as PlotlyFigure  
 from matplotlib.figure import Figure as MatplotFigure  
 import pandas as pd  
-import asyncio  
 print("Streamlit version: ", st.__version__)
   
 # Function to transform tools into the desired format  
@@ -113,7 +113,7 @@ if len(history) > 0:
                 else:
                     st.markdown(data) 
 else:  
-    history, agent_response = asyncio.run(agent_runner.run(user_input=None))  
+    history, agent_response = run_async(agent_runner.run(user_input=None))  
     with st.chat_message("assistant"):  
         st.markdown(agent_response)  
     user_history = []  
@@ -121,20 +121,21 @@ else:
 if user_input:  
     st.session_state['solution_provided'] = False  
     st.session_state['feedback'] = False  
-    with st.chat_message("user"):  
-        st.markdown(user_input)  
-        code, history, agent_response, data = asyncio.run(agent_runner.run(user_input=user_input, conversation=history))  
-        viz_output = redis_get('data' + session_id)  
+    user_message = st.chat_message("user")  
+    user_message.markdown(user_input)  
+    with st.chat_message("assistant"):  
+        result = {}  
+        stream_agent_response(iterate_async(agent_runner.run_stream(user_input=user_input, conversation=history)), result)  
+        code, history, agent_response, data = result["code"], result["conversation"], result["content"], result["data"]  
+        viz_output = list(data.values())[-1] if data else None  # the last data shown to the user  
         if viz_output is not None:  
             if type(viz_output) is PlotlyFigure:  
                 print("display chart")  
-                st.plotly_chart(viz_output)  
+                user_message.plotly_chart(viz_output)  
             else:  
                 pass
                 # st.write(viz_output)  
-    with st.chat_message("assistant"):  
         if agent_response:  
-            st.markdown(agent_response)  
             st.session_state['solution_provided'] = True  
             st.session_state['code'] = code  
             st.session_state['answer'] = agent_response  
@@ -153,4 +154,5 @@ if st.session_state['solution_provided']:
         answer = st.session_state['answer']  
         if len(code) > 0 and len(question) > 0:  
             print("adding to cache")  
-            add_to_cache(question, code, answer)  
+            shown_data = list(st.session_state['display_data'].values())[-1] if st.session_state['display_data'] else None  
+            run_async(add_to_cache(question, code, answer, shown_data))  
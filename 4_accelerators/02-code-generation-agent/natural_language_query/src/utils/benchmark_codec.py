@@ -0,0 +1,90 @@
+# Bytes stored and encode/decode time of the Redis codec against the previous pickle+base64 format, on
+# conversations and result sets like the ones the agent and the python service keep in Redis:
+#   python src/utils/benchmark_codec.py
+import argparse
+import base64
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+from openai.types.chat import ChatCompletionMessage
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.codec import Codec
+
+
+def make_conversation(questions):
+    conversation = [{"role": "system", "content": "You are a highly skilled data analyst proficient in data analysis, visualization, SQL, and Python. " * 40}]
+    for i in range(questions):
+        conversation.append({"role": "user", "content": f"What were the total sales by country in {1996 + i % 3}?"})
+        conversation.append(ChatCompletionMessage.model_validate({
+            "role": "assistant",
+            "content": "",
+            "tool_calls": [{"id": f"call_{i}", "type": "function", "function": {
+                "name": "execute_python_code",
+                "arguments": '{"assumptions": "sales are unit price times quantity", "goal": "sales by country", "python_code": "df = execute_sql_query(\\"SELECT ShipCountry, SUM(UnitPrice * Quantity) AS Sales FROM Orders JOIN [Order Details] USING (OrderID) GROUP BY ShipCountry\\")\\nshow_to_user(df)"}',
+            }}],
+        }))
+        table = "| ShipCountry | Sales |\n|---|---|\n" + "\n".join(f"| Country {j} | {j * 1234.5:.2f} |" for j in range(30))
+        conversation.append({"tool_call_id": f"call_{i}", "role": "tool", "name": "execute_python_code", "content": table})
+        conversation.append({"role": "assistant", "content": "Here are the total sales by country. Germany and the USA lead the ranking. " * 5})
+    return conversation
+
+def make_dataframe(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "OrderID": np.arange(rows),
+        "CustomerID": rng.choice(["ALFKI", "ANATR", "ANTON", "AROUT", "BERGS"], rows),
+        "OrderDate": pd.Timestamp("1996-07-04") + pd.to_timedelta(rng.integers(0, 700, rows), unit="D"),
+        "ShipCountry": rng.choice(["Germany", "USA", "France", "Brazil", "UK"], rows),
+        "Freight": rng.gamma(2.0, 30.0, rows).round(2),
+        "Quantity": rng.integers(1, 100, rows),
+    })
+
+def legacy_encode(value):
+    return base64.b64encode(pickle.dumps(value))
+
+def legacy_decode(data):
+    return pickle.loads(base64.b64decode(data))
+
+def measure(encode, decode, value, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        data = encode(value)
+    encode_ms = (time.perf_counter() - start) / repeat * 1000
+    start = time.perf_counter()
+    for _ in range(repeat):
+        decode(data)
+    decode_ms = (time.perf_counter() - start) / repeat * 1000
+    return len(data), encode_ms, decode_ms
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the Redis codec against pickle+base64")
+    arg_parser.add_argument("--rows", type=int, nargs="+", default=[30, 10000, 100000])
+    arg_parser.add_argument("--questions", type=int, default=5, help="questions in the sample conversation")
+    arg_parser.add_argument("--repeat", type=int, default=20)
+    args = arg_parser.parse_args()
+
+    values = {f"conversation ({args.questions} questions)": make_conversation(args.questions)}
+    for rows in args.rows:
+        values[f"dataframe ({rows} rows)"] = make_dataframe(rows)
+    sales = make_dataframe(1000).groupby("ShipCountry", as_index=False)["Freight"].sum()
+    values["plotly figure"] = px.bar(sales, x="ShipCountry", y="Freight")
+
+    formats = {
+        "pickle+base64": (legacy_encode, legacy_decode),
+        "codec": (Codec(compression=None).encode, Codec(compression=None).decode),
+        "codec+zstd": (Codec(compression="zstd").encode, Codec(compression="zstd").decode),
+        "codec+lz4": (Codec(compression="lz4").encode, Codec(compression="lz4").decode),
+    }
+    for name, value in values.items():
+        print(f"\n{name}")
+        print(f"{'format':<16}{'bytes':>12}{'encode ms':>12}{'decode ms':>12}")
+        for format_name, (encode, decode) in formats.items():
+            size, encode_ms, decode_ms = measure(encode, decode, value, args.repeat)
+            print(f"{format_name:<16}{size:>12}{encode_ms:>12.3f}{decode_ms:>12.3f}")
@@ -0,0 +1,83 @@
+# Throughput of single-item embedding requests against the coalescing EmbeddingBatcher.
+# A local fake Azure OpenAI embedding endpoint adds a fixed latency per request and only serves a limited
+# number of requests at a time, similar to a rate limited deployment. No Azure resources are needed:
+#   python src/utils/benchmark_embedding_batcher.py --requests 1000
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from openai import AsyncAzureOpenAI
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from agents.embedding_utils import EmbeddingBatcher
+from utils.local_server import start_server
+
+
+def create_fake_embedding_app(latency, max_concurrency, dimensions=1536):
+    app = FastAPI()
+    app.state.requests = 0
+    app.state.semaphore = None
+
+    @app.post("/openai/deployments/{deployment}/embeddings")
+    async def embeddings(deployment: str, request: Request):
+        if app.state.semaphore is None:
+            app.state.semaphore = asyncio.Semaphore(max_concurrency)
+        body = await request.json()
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        async with app.state.semaphore:
+            app.state.requests += 1
+            await asyncio.sleep(latency)
+        # JSONResponse skips FastAPI's per-element encoding, which would dominate the timing of large batches
+        return JSONResponse({
+            "object": "list",
+            "model": deployment,
+            "data": [{"object": "embedding", "index": i, "embedding": [float(len(text) % 7)] * dimensions} for i, text in enumerate(texts)],
+            "usage": {"prompt_tokens": len(texts), "total_tokens": len(texts)},
+        })
+
+    return app
+
+def create_client(endpoint):
+    return AsyncAzureOpenAI(api_key="fake", api_version="2024-04-01-preview", azure_endpoint=endpoint, max_retries=0)
+
+async def run_single_requests(endpoint, texts):
+    async with create_client(endpoint) as client:
+        await asyncio.gather(*[client.embeddings.create(input=[text], model="fake-embedding") for text in texts])
+
+async def run_batched_requests(batcher, texts):
+    await asyncio.gather(*[batcher.embed(text) for text in texts])
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the embedding batcher against single-item requests")
+    arg_parser.add_argument("--requests", type=int, default=1000, help="number of concurrent embedding calls")
+    arg_parser.add_argument("--latency-ms", type=float, default=50)
+    arg_parser.add_argument("--max-concurrency", type=int, default=8, help="requests served at a time by the fake endpoint")
+    arg_parser.add_argument("--batch-size", type=int, default=64)
+    arg_parser.add_argument("--max-wait-ms", type=float, default=5)
+    arg_parser.add_argument("--dimensions", type=int, default=64, help="size of the fake vectors, kept small so JSON encoding in this process does not hide the request overhead")
+    args = arg_parser.parse_args()
+
+    app = create_fake_embedding_app(args.latency_ms / 1000, args.max_concurrency, args.dimensions)
+    server, endpoint = start_server(app)
+    texts = [f"question number {i}" for i in range(args.requests)]
+
+    start = time.perf_counter()
+    asyncio.run(run_single_requests(endpoint, texts))
+    single_elapsed = time.perf_counter() - start
+    single_requests = app.state.requests
+
+    app.state.requests = 0
+    batcher = EmbeddingBatcher(create_client(endpoint), model="fake-embedding", max_batch_size=args.batch_size, max_wait=args.max_wait_ms / 1000)
+    start = time.perf_counter()
+    asyncio.run(run_batched_requests(batcher, texts))
+    batched_elapsed = time.perf_counter() - start
+
+    print(f"{'mode':<10}{'HTTP requests':>15}{'seconds':>10}{'embeddings/s':>15}")
+    print(f"{'single':<10}{single_requests:>15}{single_elapsed:>10.2f}{args.requests / single_elapsed:>15.0f}")
+    print(f"{'batched':<10}{app.state.requests:>15}{batched_elapsed:>10.2f}{args.requests / batched_elapsed:>15.0f}")
+    server.should_exit = True
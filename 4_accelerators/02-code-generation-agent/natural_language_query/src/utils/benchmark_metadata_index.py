@@ -0,0 +1,114 @@
+# Benchmark of the metadata work retrieve_context does per call, without the scenario router completion: parsing the
+# metadata file, building the scenario table and assembling the context of the chosen scenarios, as it was done on
+# every call before and with the memoized MetadataIndex. Runs on a generated warehouse sized metadata file and on the
+# bundled one, and checks both produce the same context.
+#   python src/utils/benchmark_metadata_index.py --tables 500 --scenarios 200
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from agents.metadata_index import MetadataIndex
+
+
+def legacy_retrieve_context(path, scenario_names):
+    # retrieve_context before the metadata index, minus the completion
+    with open(path, "r") as file:
+        data = json.load(file)
+    analytic_scenarios = data.get("analytic_scenarios", {})
+    scenario_list = [(scenario[0], scenario[1]['description']) for scenario in analytic_scenarios.items()]
+    scenario_list_md = ""
+    for scenario in scenario_list:
+        scenario_list_md += f"| {scenario[0]} | {scenario[1]} |\n"
+    scenario_list_md = f"| Scenario | Description |\n| --- | --- |\n{scenario_list_md}"
+    analytic_scenarios = data.get("analytic_scenarios", {})
+    scenario_list = [scenario[0] for scenario in analytic_scenarios.items()]
+    if not set(scenario_names).issubset(set(scenario_list)):
+        raise Exception("You provided invalid scenario name(s), please check and try again")
+    scenario_tables = data.get("scenario_tables", {})
+    scenario_context = "Following tables might be relevant to the question: \n"
+    all_tables = data.get("tables", {})
+    all_relationships = data.get("table_relationships", {})
+    all_relationships = {(relationship[0], relationship[1]): relationship[2] for relationship in all_relationships}
+    tables = set()
+    for scenario_name in scenario_names:
+        tables.update(scenario_tables.get(scenario_name, []))
+    for table in tables:
+        scenario_context += f"- table_name: {table} - description: {all_tables[table]['description']} - columns: {all_tables[table]['columns']}\n"
+    table_pairs = [(table1, table2) for table1 in tables for table2 in tables if table1 != table2]
+    relationships = set()
+    for table_pair in table_pairs:
+        relationship = all_relationships.get(table_pair, None)
+        if relationship:
+            relationships.add((table_pair[0], table_pair[1], relationship))
+    scenario_context += "\nTable relationships: \n"
+    for relationship in relationships:
+        scenario_context += f"- {relationship[0]}, {relationship[1]}:{relationship[2]}\n"
+    scenario_context += "\nFollowing rules might be relevant: \n"
+    for scenario_name in scenario_names:
+        scenario_context += f"- {scenario_name}: {str(analytic_scenarios[scenario_name]['rules'])}\n"
+    return scenario_list_md, scenario_context
+
+def indexed_retrieve_context(metadata_index, scenario_names):
+    metadata = metadata_index.current()
+    if not set(scenario_names).issubset(metadata.scenarios):
+        raise Exception("You provided invalid scenario name(s), please check and try again")
+    return metadata.scenario_list_md, metadata.context(scenario_names)
+
+def generate_metadata(tables, scenarios, tables_per_scenario, columns, relationships_per_table, seed=0):
+    rng = random.Random(seed)
+    table_names = [f"table_{i}" for i in range(tables)]
+    data = {
+        "analytic_scenarios": {f"Scenario {i}": {"rules": [f"Rule {i}.{j} of the scenario" for j in range(3)], "description": f"Analyzing business area {i} of the warehouse."} for i in range(scenarios)},
+        "tables": {name: {"columns": [f"Column{j} VARCHAR" for j in range(columns)], "description": f"Records of {name}."} for name in table_names},
+        "scenario_tables": {f"Scenario {i}": rng.sample(table_names, tables_per_scenario) for i in range(scenarios)},
+        "table_relationships": [[name, rng.choice(table_names), f"{name}.Key{j} = Other.Key{j}"] for name in table_names for j in range(relationships_per_table)],
+    }
+    path = os.path.join(tempfile.mkdtemp(), "metadata.json")
+    with open(path, "w") as file:
+        json.dump(data, file)
+    return path
+
+def same_context(legacy, indexed):
+    # The legacy context lists tables and relationships in set order, compare the lines
+    return legacy[0] == indexed[0] and sorted(legacy[1].splitlines()) == sorted(indexed[1].splitlines())
+
+def measure(name, function, requests):
+    start = time.perf_counter()
+    for scenario_names in requests:
+        function(scenario_names)
+    return (time.perf_counter() - start) / len(requests) * 1000
+
+def run(label, path, calls, scenarios_per_call, seed=1):
+    with open(path) as file:
+        scenario_names = list(json.load(file)["analytic_scenarios"])
+    rng = random.Random(seed)
+    requests = [rng.sample(scenario_names, min(scenarios_per_call, len(scenario_names))) for _ in range(calls)]
+    metadata_index = MetadataIndex(path)
+    assert all(same_context(legacy_retrieve_context(path, names), indexed_retrieve_context(metadata_index, names)) for names in requests[:20])
+    legacy_ms = measure("legacy", lambda names: legacy_retrieve_context(path, names), requests)
+    indexed_ms = measure("indexed", lambda names: indexed_retrieve_context(metadata_index, names), requests)
+    print(f"{label:<28}{legacy_ms:>12.3f}{indexed_ms:>12.3f}{legacy_ms / indexed_ms:>10.1f}x")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the metadata work of retrieve_context with and without the metadata index")
+    arg_parser.add_argument("--tables", type=int, default=500)
+    arg_parser.add_argument("--scenarios", type=int, default=200)
+    arg_parser.add_argument("--tables-per-scenario", type=int, default=15)
+    arg_parser.add_argument("--columns", type=int, default=20)
+    arg_parser.add_argument("--relationships-per-table", type=int, default=3)
+    arg_parser.add_argument("--scenarios-per-call", type=int, default=3)
+    arg_parser.add_argument("--calls", type=int, default=200)
+    args = arg_parser.parse_args()
+
+    print(f"{'metadata':<28}{'legacy ms':>12}{'indexed ms':>12}{'speedup':>11}")
+    bundled = os.path.join(os.path.dirname(__file__), "..", "..", "data", "metadata.json")
+    if os.path.exists(bundled):
+        run("bundled metadata.json", bundled, args.calls, args.scenarios_per_call)
+    generated = generate_metadata(args.tables, args.scenarios, args.tables_per_scenario, args.columns, args.relationships_per_table)
+    run(f"{args.tables} tables, {args.scenarios} scenarios", generated, args.calls, args.scenarios_per_call)
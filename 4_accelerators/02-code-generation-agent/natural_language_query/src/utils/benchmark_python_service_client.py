@@ -0,0 +1,83 @@
+# Per-call overhead of execute_python_code's HTTP client: a new httpx.AsyncClient per call against the shared,
+# kept-alive client in agents/tools.py. A local stub of the python service answers immediately, so the timings
+# only contain client and connection overhead. No Azure resources are needed:
+#   python src/utils/benchmark_python_service_client.py --calls 500
+# The stub is plain HTTP; against the deployed service every new client also pays a TLS handshake.
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.local_server import start_server
+
+
+def create_stub_app():
+    app = FastAPI()
+    app.state.requests = 0
+
+    @app.post("/execute/")
+    async def execute_code():
+        app.state.requests += 1
+        return JSONResponse({"output": "The graph for the data was displayed to the user."})
+
+    return app
+
+def create_shared_client(endpoint, max_connections):
+    # Same settings as create_python_service_client in agents/tools.py
+    return httpx.AsyncClient(
+        base_url=endpoint,
+        timeout=httpx.Timeout(120, connect=5, pool=None),
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections, keepalive_expiry=60),
+    )
+
+payload = {"assumptions": "", "goal": "", "python_code": "print(1)", "session_id": "benchmark"}
+
+async def call_with_new_client(endpoint):
+    async with httpx.AsyncClient() as client:
+        response = await client.post(f"{endpoint}/execute/", json=payload)
+        return response.json()["output"]
+
+async def call_with_shared_client(client):
+    response = await client.post("/execute/", json=payload)
+    return response.json()["output"]
+
+async def run_sequential(calls, call):
+    start = time.perf_counter()
+    for _ in range(calls):
+        await call()
+    return (time.perf_counter() - start) / calls * 1000
+
+async def run_concurrent(calls, call):
+    start = time.perf_counter()
+    await asyncio.gather(*[call() for _ in range(calls)])
+    return time.perf_counter() - start
+
+async def run_benchmark(endpoint, calls, max_connections):
+    print(f"{'client':<14}{'ms/call sequential':>20}{f'{calls} concurrent calls (s)':>28}")
+    new_client_call = lambda: call_with_new_client(endpoint)
+    sequential = await run_sequential(calls, new_client_call)
+    concurrent = await run_concurrent(calls, new_client_call)
+    print(f"{'new per call':<14}{sequential:>20.2f}{concurrent:>28.2f}")
+    async with create_shared_client(endpoint, max_connections) as client:
+        shared_client_call = lambda: call_with_shared_client(client)
+        await shared_client_call()  # open the first connection outside the timing, as a running app would have
+        sequential = await run_sequential(calls, shared_client_call)
+        concurrent = await run_concurrent(calls, shared_client_call)
+    print(f"{'shared':<14}{sequential:>20.2f}{concurrent:>28.2f}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the shared python service client against a new client per call")
+    arg_parser.add_argument("--calls", type=int, default=500)
+    arg_parser.add_argument("--max-connections", type=int, default=20)
+    args = arg_parser.parse_args()
+
+    server, endpoint = start_server(create_stub_app())
+    asyncio.run(run_benchmark(endpoint, args.calls, args.max_connections))
+    server.should_exit = True
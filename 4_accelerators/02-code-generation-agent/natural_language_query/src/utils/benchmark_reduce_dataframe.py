@@ -0,0 +1,113 @@
+# Time of the python service's result post-processing on a 100k-row Northwind-style frame: type conversion of
+# query results and reduce_dataframe_size, against the previous per-cell implementations. Runs offline on a
+# generated SQLite database:
+#   python src/utils/benchmark_reduce_dataframe.py --rows 100000
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def create_database(path, rows, seed=0):
+    rng = np.random.default_rng(seed)
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE Orders (OrderID INTEGER PRIMARY KEY, CustomerID TEXT, EmployeeID INTEGER, OrderDate DATETIME, RequiredDate DATETIME, ShippedDate DATETIME, ShipVia INTEGER, Freight REAL, ShipName TEXT, ShipAddress TEXT, ShipCity TEXT, ShipCountry TEXT, Notes TEXT)")
+    order_dates = pd.Timestamp("2016-07-04") + pd.to_timedelta(rng.integers(0, 700, rows), unit="D")
+    notes = [json.dumps({"tags": ["priority", "gift", "fragile", "bulk", "export"][: 1 + i % 5], "items": list(range(i % 12))}) if i % 10 == 0 else f"Deliver to the back door, call {i}" for i in range(rows)]
+    records = zip(
+        range(1, rows + 1),
+        rng.choice(["ALFKI", "ANATR", "ANTON", "AROUT", "BERGS"], rows).tolist(),
+        rng.integers(1, 10, rows).tolist(),
+        order_dates.strftime("%Y-%m-%d %H:%M:%S.000").tolist(),
+        (order_dates + pd.Timedelta(days=28)).strftime("%Y-%m-%d %H:%M:%S.000").tolist(),
+        (order_dates + pd.Timedelta(days=7)).strftime("%Y-%m-%d %H:%M:%S.000").tolist(),
+        rng.integers(1, 4, rows).tolist(),
+        rng.gamma(2.0, 30.0, rows).round(2).tolist(),
+        [f"Ship name {i % 89} " * 3 for i in range(rows)],
+        [f"Obere Str. {i % 500} " * 8 for i in range(rows)],
+        rng.choice(["Berlin", "Seattle", "Lyon", "Rio de Janeiro", "London"], rows).tolist(),
+        rng.choice(["Germany", "USA", "France", "Brazil", "UK"], rows).tolist(),
+        notes,
+    )
+    connection.executemany("INSERT INTO Orders VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", records)
+    connection.commit()
+    connection.close()
+
+# Previous implementations, kept here for comparison
+def legacy_convert_types(result):
+    result = result.infer_objects()
+    for col in result.columns:
+        if 'date' in col.lower():
+            try:
+                result[col] = pd.to_datetime(result[col])  # errors="ignore", which newer pandas versions removed
+            except (ValueError, TypeError):
+                pass
+    return result
+
+def legacy_reduce_dataframe_size(df):
+    max_str_length = 100
+    max_list_length = 3
+    reduced_df = pd.DataFrame()
+    for column in df.columns:
+        if pd.api.types.is_object_dtype(df[column]) or pd.api.types.is_string_dtype(df[column]):  # dtype == object before pandas 3
+            reduced_df[column] = df[column].apply(lambda x: legacy_reduce_cell(x, max_str_length, max_list_length))
+        else:
+            reduced_df[column] = df[column]
+    return reduced_df
+
+def legacy_reduce_cell(cell, max_str_length, max_list_length):
+    try:
+        data = json.loads(cell)
+        if isinstance(data, list):
+            data = legacy_truncate(data, max_list_length)
+        return json.dumps(data)
+    except (json.JSONDecodeError, TypeError):
+        return str(cell)[:max_str_length]
+
+def legacy_truncate(value, max_list_length):
+    if isinstance(value, list):
+        return [legacy_truncate(item, max_list_length) for item in value[:max_list_length]]
+    if isinstance(value, dict):
+        return {key: legacy_truncate(item, max_list_length) for key, item in value.items()}
+    return value
+
+def timed(function, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best * 1000
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark result type conversion and reduce_dataframe_size")
+    arg_parser.add_argument("--rows", type=int, default=100000)
+    args = arg_parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "orders.db")
+    create_database(db_path, args.rows)
+    os.environ["SQLITE_DB_PATH"] = db_path
+    from api.sandbox import CodeRunner
+    runner = CodeRunner()
+    with runner.engine.connect() as connection:
+        raw = pd.read_sql_query("SELECT * FROM Orders", connection)
+
+    legacy_converted, legacy_ms = timed(legacy_convert_types, raw)
+    converted, new_ms = timed(runner.convert_types, raw)
+    print(f"{args.rows} rows, {raw.shape[1]} columns")
+    print(f"{'step':<28}{'previous ms':>14}{'new ms':>10}")
+    print(f"{'type conversion':<28}{legacy_ms:>14.1f}{new_ms:>10.1f}")
+    legacy_reduced, legacy_ms = timed(legacy_reduce_dataframe_size, converted)
+    reduced, new_ms = timed(runner.reduce_dataframe_size, converted)
+    print(f"{'reduce_dataframe_size':<28}{legacy_ms:>14.1f}{new_ms:>10.1f}")
+    print(f"date columns: {[col for col in converted.columns if pd.api.types.is_datetime64_any_dtype(converted[col])]}")
+    print(f"reduced frames equal: {legacy_reduced.astype(str).equals(reduced.astype(str))}")
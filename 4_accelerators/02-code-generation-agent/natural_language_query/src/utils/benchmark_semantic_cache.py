@@ -0,0 +1,78 @@
+# Offline benchmark of the local semantic cache (SEMANTIC_CACHE_BACKEND=local): fills a cache file with generated
+# questions and clustered embeddings, then measures lookup latency, the hit rate of paraphrased questions at
+# SEMANTIC_HIT_THRESHOLD, deduplication of repeated questions and capacity eviction. No embedding calls are made.
+#   python src/utils/benchmark_semantic_cache.py --entries 10000 --threshold 0.02
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from agents.semantic_cache import LocalSemanticCache
+
+MEASURES = ["total sales", "number of orders", "average freight", "revenue", "quantity sold", "average discount"]
+GROUPINGS = ["country", "customer", "employee", "product category", "shipper", "supplier", "year", "month", "region"]
+FILTERS = ["in 1997", "for beverages", "in Germany", "for the top 10 customers", "since 1996", "for discontinued products"]
+
+
+def generate_questions(count, rng):
+    questions = set()
+    while len(questions) < count:
+        questions.add(f"What is the {rng.choice(MEASURES)} by {rng.choice(GROUPINGS)} {rng.choice(FILTERS)} #{rng.randrange(count * 10)}")
+    return list(questions)
+
+def paraphrase(question):
+    return question.replace("What is the", "Show me the").replace(" by ", " per ")
+
+def measure(cache, lookups, threshold):
+    latencies, hits = [], 0
+    for question, vector, expected in lookups:
+        start = time.perf_counter()
+        results = cache.search_sync(question, vector)
+        latencies.append(time.perf_counter() - start)
+        hits += bool(results) and results[0]["score"] >= threshold and results[0]["question"] == expected
+    latencies = np.array(latencies) * 1000
+    return np.percentile(latencies, 50), np.percentile(latencies, 99), hits / len(lookups)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the local semantic cache offline")
+    arg_parser.add_argument("--entries", type=int, default=10000)
+    arg_parser.add_argument("--dim", type=int, default=1536)
+    arg_parser.add_argument("--lookups", type=int, default=1000)
+    arg_parser.add_argument("--threshold", type=float, default=float(os.getenv("SEMANTIC_HIT_THRESHOLD", 0.02)))
+    args = arg_parser.parse_args()
+
+    rng = random.Random(0)
+    np_rng = np.random.default_rng(0)
+    questions = generate_questions(args.entries, rng)
+    vectors = np_rng.standard_normal((args.entries, args.dim), dtype=np.float32)
+    path = os.path.join(tempfile.mkdtemp(), "semantic_cache.db")
+    cache = LocalSemanticCache(path, max_entries=args.entries)
+    start = time.perf_counter()
+    for question, vector in zip(questions, vectors):
+        cache.add_sync(question, f"df = execute_sql_query('SELECT 1')  # {question}", f"Answer to {question}", vector)
+    print(f"Added {len(cache)} entries in {time.perf_counter() - start:.1f}s")
+
+    # Paraphrased questions with a slightly perturbed embedding should hit their entry, unrelated ones should not
+    sample = rng.sample(range(args.entries), args.lookups)
+    paraphrased = [(paraphrase(questions[i]), vectors[i] + 0.3 * np_rng.standard_normal(args.dim, dtype=np.float32), questions[i]) for i in sample]
+    unrelated = [("How many employees joined in " + str(1990 + i % 10), np_rng.standard_normal(args.dim, dtype=np.float32), None) for i in range(args.lookups)]
+    print(f"{'lookups':<14}{'p50 ms':>10}{'p99 ms':>10}{'hit rate':>10}")
+    for name, lookups in [("paraphrased", paraphrased), ("unrelated", unrelated)]:
+        p50, p99, hit_rate = measure(cache, lookups, args.threshold)
+        print(f"{name:<14}{p50:>10.3f}{p99:>10.3f}{hit_rate:>10.1%}")
+
+    # The same question again replaces its entry, a new question evicts the least recently used one
+    size = len(cache)
+    cache.add_sync(questions[0], "df = None", "Newer answer", vectors[0])
+    replaced = cache.search_sync(questions[0], vectors[0])[0]
+    print(f"dedup: size {size} -> {len(cache)}, entry now answers {replaced['answer']!r}")
+    cache.add_sync("A question that was never asked", "df = None", "New answer", np_rng.standard_normal(args.dim, dtype=np.float32))
+    print(f"eviction: size {len(cache)} with max_entries {cache.max_entries}")
+    reopened = LocalSemanticCache(path, max_entries=args.entries)
+    print(f"reopened from disk: {len(reopened)} entries")
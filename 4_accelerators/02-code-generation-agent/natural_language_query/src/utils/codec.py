@@ -0,0 +1,132 @@
+# Binary codec for the values the agent and the python service keep in Redis: conversations, dataframes, figures
+# and display strings. Values are stored as raw bytes with a small header, no base64, and compressed above a size
+# threshold. Encoders are picked by type and new ones can be registered; anything else falls back to pickle.
+import base64
+import io
+import pickle
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+MARKER = b"\x00"  # base64 never starts with a zero byte, which tells new values apart from legacy pickle+base64 ones
+
+class Encoder():
+    def __init__(self, tag, matches, encode, decode):
+        self.tag = tag
+        self.matches = matches
+        self.encode = encode
+        self.decode = decode
+
+def _is_message_list(value):
+    return isinstance(value, list) and all(isinstance(item, dict) or hasattr(item, "model_dump") for item in value)
+
+def _encode_messages(messages):
+    # Chat completion messages become plain dicts, which the agent and the OpenAI client accept alike
+    items = [item.model_dump(exclude_none=True) if hasattr(item, "model_dump") else item for item in messages]
+    return msgpack.packb(items, use_bin_type=True)
+
+def _decode_messages(data):
+    return msgpack.unpackb(data, raw=False)
+
+def _is_dataframe(value):
+    return type(value).__name__ == "DataFrame" and type(value).__module__.startswith("pandas")
+
+def _encode_dataframe(df):
+    table = pa.Table.from_pandas(df)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+def _decode_dataframe(data):
+    with pa.ipc.open_stream(data) as reader:
+        return reader.read_all().to_pandas()
+
+def _is_plotly_figure(value):
+    return type(value).__name__ == "Figure" and type(value).__module__.startswith("plotly")
+
+def _encode_plotly_figure(fig):
+    return fig.to_json().encode("utf-8")
+
+def _decode_plotly_figure(data):
+    import plotly.io
+    return plotly.io.from_json(data.decode("utf-8"))
+
+def _encode_pickle(value):
+    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+class Codec():
+    """
+    Encodes values for Redis as MARKER + encoder tag + compression tag + payload.
+
+    Args:
+        compression (str): "zstd", "lz4" or None. Unavailable libraries disable compression.
+        compression_threshold (int): payloads smaller than this many bytes are stored uncompressed.
+    """
+    def __init__(self, compression="zstd", compression_threshold=1024):
+        self.compression = compression if (compression == "zstd" and zstandard) or (compression == "lz4" and lz4) else None
+        self.compression_threshold = compression_threshold
+        self.encoders = []
+        self.decoders = {b"p": pickle.loads}
+        if msgpack is not None:
+            self.register(Encoder(b"m", _is_message_list, _encode_messages, _decode_messages))
+        if pa is not None:
+            self.register(Encoder(b"a", _is_dataframe, _encode_dataframe, _decode_dataframe))
+        self.register(Encoder(b"f", _is_plotly_figure, _encode_plotly_figure, _decode_plotly_figure))
+        self.register(Encoder(b"s", lambda value: type(value) is str, lambda value: value.encode("utf-8"), lambda data: data.decode("utf-8")))
+
+    def register(self, encoder):
+        self.encoders.append(encoder)
+        self.decoders[encoder.tag] = encoder.decode
+
+    def _compress(self, payload):
+        if self.compression is None or len(payload) < self.compression_threshold:
+            return b"n", payload
+        if self.compression == "zstd":
+            return b"z", zstandard.ZstdCompressor(level=3).compress(payload)
+        return b"l", lz4.frame.compress(payload)
+
+    def _decompress(self, compression_tag, payload):
+        if compression_tag == b"z":
+            return zstandard.ZstdDecompressor().decompress(payload)
+        if compression_tag == b"l":
+            return lz4.frame.decompress(payload)
+        return payload
+
+    def encode(self, value):
+        tag, payload = b"p", None
+        for encoder in self.encoders:
+            if encoder.matches(value):
+                try:
+                    tag, payload = encoder.tag, encoder.encode(value)
+                    break
+                except Exception:
+                    # e.g. object columns Arrow cannot convert, pickle still can
+                    continue
+        if payload is None:
+            payload = _encode_pickle(value)
+        compression_tag, payload = self._compress(payload)
+        return MARKER + tag + compression_tag + payload
+
+    def decode(self, data):
+        if data is None:
+            return None
+        if data[:1] != MARKER:
+            return pickle.loads(base64.b64decode(data))
+        tag, compression_tag = data[1:2], data[2:3]
+        return self.decoders[tag](self._decompress(compression_tag, data[3:]))
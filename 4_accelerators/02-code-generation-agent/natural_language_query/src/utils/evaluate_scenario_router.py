@@ -0,0 +1,84 @@
+# Offline evaluation of the embedding scenario router against the model router of retrieve_context, on labelled
+# business concepts (data/scenario_router_eval.json by default, a list of {"business_concepts", "scenarios"}).
+# Reports the accuracy of both routers, how many questions the embedding router answers on its own at several
+# margins, and the latency that saves. Uses the Azure OpenAI deployments in secrets.env, run it from the
+# natural_language_query directory:
+#   python src/utils/evaluate_scenario_router.py
+#   python src/utils/evaluate_scenario_router.py --margins 0 0.02 0.05 0.1 --no-model
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from agents.scenario_router import ScenarioRouter
+from agents.tools import get_embedding, metadata_index, route_scenarios_with_model
+
+
+def is_correct(predicted, expected):
+    return predicted is not None and set(predicted) == set(expected)
+
+async def evaluate(items, margins, min_score, use_model):
+    metadata = metadata_index.current()
+    router = ScenarioRouter(get_embedding)
+    await router.scores(metadata, items[0]["business_concepts"])  # embeds the scenarios once, outside the timings
+    results = []
+    for item in items:
+        start = time.perf_counter()
+        names, scores = await router.scores(metadata, item["business_concepts"])
+        router_latency = time.perf_counter() - start
+        model_names, model_latency = None, None
+        if use_model:
+            start = time.perf_counter()
+            try:
+                model_names = await route_scenarios_with_model(metadata, item["business_concepts"])
+            except Exception as e:
+                print(f"model router failed for {item['business_concepts']!r}: {e}")
+            model_latency = time.perf_counter() - start
+        results.append({"item": item, "names": names, "scores": scores, "router_latency": router_latency,
+                        "model_names": model_names, "model_latency": model_latency})
+
+    print(f"{len(items)} labelled questions, {len(metadata.scenarios)} scenarios")
+    router_ms = np.mean([result["router_latency"] for result in results]) * 1000
+    best = [list(dict.fromkeys(result["names"][index] for index in result["scores"].argmax(axis=1))) for result in results]
+    print(f"embedding router, best scenario only: accuracy {np.mean([is_correct(names, result['item']['scenarios']) for names, result in zip(best, results)]):.1%}, {router_ms:.1f} ms per question")
+    model_ms = None
+    if use_model:
+        model_ms = np.mean([result["model_latency"] for result in results]) * 1000
+        print(f"model router: accuracy {np.mean([is_correct(result['model_names'], result['item']['scenarios']) for result in results]):.1%}, {model_ms:.0f} ms per question")
+    print()
+    print(f"{'margin':>8}{'routed':>9}{'routed acc':>12}{'agrees':>9}{'combined acc':>14}{'saved ms/q':>12}")
+    for margin in margins:
+        routed = correct = agrees = combined = 0
+        for result in results:
+            names = router.decide(result["names"], result["scores"], margin=margin, min_score=min_score)
+            expected = result["item"]["scenarios"]
+            if names is not None:
+                routed += 1
+                correct += is_correct(names, expected)
+                agrees += use_model and is_correct(names, result["model_names"] or [])
+                combined += is_correct(names, expected)
+            elif use_model:
+                combined += is_correct(result["model_names"], expected)
+        routed_accuracy = f"{correct / routed:.1%}" if routed else "-"
+        agreement = f"{agrees / routed:.1%}" if routed and use_model else "-"
+        combined_accuracy = f"{combined / len(results):.1%}" if use_model else "-"
+        # Routed questions skip the completion, every question pays for the concept embeddings
+        saved = f"{routed / len(results) * model_ms - router_ms:.0f}" if use_model else "-"
+        print(f"{margin:>8.3f}{routed / len(results):>9.1%}{routed_accuracy:>12}{agreement:>9}{combined_accuracy:>14}{saved:>12}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Evaluate the embedding scenario router against the model router")
+    arg_parser.add_argument("--questions", default="data/scenario_router_eval.json")
+    arg_parser.add_argument("--margins", type=float, nargs="+", default=[0.0, 0.01, 0.02, 0.03, 0.05, 0.08, 0.1])
+    arg_parser.add_argument("--min-score", type=float, default=0.0)
+    arg_parser.add_argument("--no-model", action="store_true", help="only evaluate the embedding router against the labels")
+    args = arg_parser.parse_args()
+    with open(args.questions) as file:
+        items = json.load(file)
+    asyncio.run(evaluate(items, args.margins, args.min_score, not args.no_model))
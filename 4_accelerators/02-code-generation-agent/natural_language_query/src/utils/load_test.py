@@ -0,0 +1,39 @@
+# Load test of the async agent: runs N sessions concurrently in one process and compares their latency
+# with a single session. Uses the services configured in secrets.env (Azure OpenAI, AI Search, Redis and
+# the python service), run it from the natural_language_query directory:
+#   python src/utils/load_test.py --sessions 10
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from agents.smart_agent import Agent_Orchestrator
+
+
+async def run_session(question):
+    agent_runner = Agent_Orchestrator(session_id=str(uuid.uuid4()))
+    start = time.perf_counter()
+    await agent_runner.run(user_input=question)
+    return time.perf_counter() - start
+
+async def run_load_test(question, sessions):
+    single_latency = await run_session(question)
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*[run_session(question) for _ in range(sessions)])
+    wall_time = time.perf_counter() - start
+    latencies = sorted(latencies)
+    print(f"single session: {single_latency:.2f}s")
+    print(f"{sessions} concurrent sessions: wall time {wall_time:.2f}s, "
+          f"median {latencies[len(latencies) // 2]:.2f}s, max {latencies[-1]:.2f}s")
+    print(f"wall time / single session latency: {wall_time / single_latency:.2f} (sequential execution would be about {sessions})")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Run concurrent agent sessions in one process")
+    arg_parser.add_argument("--sessions", type=int, default=10)
+    arg_parser.add_argument("--question", default="What are the total sales broken down by country?")
+    args = arg_parser.parse_args()
+    asyncio.run(run_load_test(args.question, args.sessions))
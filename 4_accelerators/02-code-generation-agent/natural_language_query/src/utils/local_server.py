@@ -0,0 +1,18 @@
+# Local uvicorn server for the benchmarks that put a stub service behind a real HTTP connection.
+import socket
+import threading
+import time
+
+import uvicorn
+
+
+def start_server(app):
+    # Serves app on a free local port from a daemon thread, returns the server and its base URL once it accepts requests
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}"
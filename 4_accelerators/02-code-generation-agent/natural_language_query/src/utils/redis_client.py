@@ -0,0 +1,20 @@
+# Redis client factory shared by the agent and the python service, with an explicitly sized connection pool
+# instead of the implicit one a bare StrictRedis creates.
+import os
+
+import redis
+
+
+def create_redis_client(max_connections=None):
+    pool = redis.ConnectionPool(
+        connection_class=redis.SSLConnection,
+        host=os.getenv("AZURE_REDIS_ENDPOINT"),
+        port=6380,
+        password=os.getenv("AZURE_REDIS_KEY"),
+        max_connections=max_connections or int(os.getenv("REDIS_MAX_CONNECTIONS", 50)),
+        socket_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", 10)),
+        socket_connect_timeout=float(os.getenv("REDIS_CONNECT_TIMEOUT", 5)),
+        socket_keepalive=True,
+        health_check_interval=30,  # Azure Cache for Redis closes idle connections after 10 minutes
+    )
+    return redis.StrictRedis(connection_pool=pool)
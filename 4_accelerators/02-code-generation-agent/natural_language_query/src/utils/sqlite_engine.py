@@ -0,0 +1,66 @@
+# SQLite engine factory with a connection pool and a PRAGMA profile per use case. The analytics database is only
+# read, so it is opened read-only; the immutable flag, which also skips all file locking, is opt-in.
+import os
+import sqlite3
+from urllib.parse import quote
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+
+def sqlite_uri(db_path, read_only=False, immutable=False):
+    params = []
+    if read_only:
+        params.append("mode=ro")
+    if immutable:
+        params.append("immutable=1")  # no locking or change detection at all, only for files nobody writes
+    return f"file:{quote(os.path.abspath(db_path))}" + ("?" + "&".join(params) if params else "")
+
+def create_sqlite_engine(db_path, read_only=False, immutable=False, wal=False, pool_size=5, max_overflow=5,
+                         mmap_size=256 * 1024 * 1024, cache_size_kib=64 * 1024, busy_timeout_ms=5000):
+    """
+    Creates a SQLAlchemy engine for a SQLite file.
+
+    Args:
+        db_path (str): path of the database file.
+        read_only (bool): open the file read-only.
+        immutable (bool): also tell SQLite the file never changes, which skips all locking.
+        wal (bool): use the WAL journal, so readers do not block the writer and the writer does not block readers.
+        pool_size (int): connections kept open, size it to the number of threads that query concurrently.
+        max_overflow (int): additional connections opened under load.
+        mmap_size (int): bytes of the file read through memory mapping.
+        cache_size_kib (int): page cache of each connection in KiB.
+        busy_timeout_ms (int): how long a connection waits for a lock before failing with "database is locked".
+    """
+    uri = sqlite_uri(db_path, read_only=read_only, immutable=immutable)
+
+    def connect():
+        # Connections are handed between threads by the pool, never used by two threads at once
+        return sqlite3.connect(uri, uri=True, check_same_thread=False, timeout=busy_timeout_ms / 1000)
+
+    engine = create_engine("sqlite://", creator=connect, poolclass=QueuePool, pool_size=pool_size, max_overflow=max_overflow)
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if wal and not read_only:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")  # durable at checkpoints, safe from corruption with WAL
+        cursor.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+        cursor.execute(f"PRAGMA cache_size={-int(cache_size_kib)}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    return engine
+
+def analytics_engine(db_path, pool_size=2):
+    # Read-only engine of the analytics database. SQLITE_IMMUTABLE=true is only safe if the file is never updated while
+    # the service runs: the SQL result and answer caches detect changes of the file, immutable connections do not.
+    return create_sqlite_engine(
+        db_path,
+        read_only=True,
+        immutable=os.getenv("SQLITE_IMMUTABLE", "false").lower() == "true",
+        pool_size=pool_size,
+        mmap_size=int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+        cache_size_kib=int(os.getenv("SQLITE_CACHE_SIZE_KIB", 64 * 1024)),
+    )
@@ -0,0 +1,131 @@
+# Latency benchmark of the booking lookups of load_user_flight_info and check_flight_status on a generated database
+# with 1M bookings: first without indexes and with session.query as before, then after the ensure_indexes migration
+# with the cached lambda statements the tools use now. The model mirrors Flight in flight_copilot_utils.py.
+#   python benchmark_booking_queries.py --bookings 1000000 --queries 500
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import Column, DateTime, Index, Integer, String, lambda_stmt, select
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from db_utils import create_sqlite_engine, ensure_indexes, session_scope
+
+Base = declarative_base()
+
+class Flight(Base):
+    __tablename__ = 'flights'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    customer_id = Column(String)
+    ticket_num = Column(String)
+    flight_num = Column(String)
+    airline = Column(String)
+    seat_num = Column(String)
+    departure_airport = Column(String)
+    arrival_airport = Column(String)
+    departure_time = Column(DateTime)
+    arrival_time = Column(DateTime)
+    ticket_class = Column(String)
+    gate = Column(String)
+    status = Column(String)
+    __table_args__ = (
+        Index('ix_flights_customer_id_status', 'customer_id', 'status'),
+        Index('ix_flights_ticket_num_status', 'ticket_num', 'status'),
+        Index('ix_flights_flight_num_departure_airport_status', 'flight_num', 'departure_airport', 'status'),
+    )
+
+
+def create_database(db_path, bookings, flights_per_customer, airports):
+    # Plain sqlite3 and the table without its indexes, like a database file created before the indexes were added
+    connection = sqlite3.connect(db_path)
+    connection.execute("CREATE TABLE flights (id INTEGER PRIMARY KEY AUTOINCREMENT, customer_id VARCHAR, ticket_num VARCHAR, flight_num VARCHAR, airline VARCHAR, seat_num VARCHAR, "
+                       "departure_airport VARCHAR, arrival_airport VARCHAR, departure_time DATETIME, arrival_time DATETIME, ticket_class VARCHAR, gate VARCHAR, status VARCHAR)")
+    rng = random.Random(0)
+    start = datetime(2024, 1, 1)
+    batch = []
+    for i in range(bookings):
+        departure = start + timedelta(minutes=rng.randrange(525600))
+        batch.append((str(i // flights_per_customer), f"{i:010d}", f"AA{rng.randrange(10000):04d}", "Contoso Air", f"{rng.randrange(1, 40)}A",
+                      f"A{rng.randrange(airports):03d}", f"A{rng.randrange(airports):03d}", departure.isoformat(sep=" "), (departure + timedelta(hours=2)).isoformat(sep=" "),
+                      "economy", f"G{rng.randrange(50)}", "open" if rng.random() < 0.8 else "cancelled"))
+        if len(batch) == 100000:
+            connection.executemany("INSERT INTO flights (customer_id, ticket_num, flight_num, airline, seat_num, departure_airport, arrival_airport, departure_time, arrival_time, ticket_class, gate, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+            batch = []
+    if batch:
+        connection.executemany("INSERT INTO flights (customer_id, ticket_num, flight_num, airline, seat_num, departure_airport, arrival_airport, departure_time, arrival_time, ticket_class, gate, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+    connection.commit()
+    flight_keys = connection.execute("SELECT flight_num, departure_airport FROM flights ORDER BY RANDOM() LIMIT 10000").fetchall()
+    connection.close()
+    return flight_keys
+
+def flight_info(flight):
+    return {'flight_num': flight.flight_num, 'departure_airport': flight.departure_airport, 'arrival_airport': flight.arrival_airport,
+            'departure_time': flight.departure_time.strftime('%Y-%m-%d %H:%M'), 'status': flight.status}
+
+# Lookups as the tools ran them before
+def load_user_flight_info_query(session, customer_id):
+    with session_scope(session) as db_session:
+        return str([flight_info(flight) for flight in db_session.query(Flight).filter_by(customer_id=customer_id, status="open").all()])
+
+def check_flight_status_query(session, flight_num, from_):
+    with session_scope(session) as db_session:
+        result = db_session.query(Flight).filter_by(flight_num=flight_num, departure_airport=from_, status="open").first()
+        return str(flight_info(result) if result is not None else None)
+
+# Lookups as the tools run them now
+def load_user_flight_info_stmt(session, customer_id):
+    with session_scope(session) as db_session:
+        return str([flight_info(flight) for flight in db_session.execute(lambda_stmt(lambda: select(Flight).where(Flight.customer_id == customer_id, Flight.status == "open"))).scalars()])
+
+def check_flight_status_stmt(session, flight_num, from_):
+    with session_scope(session) as db_session:
+        result = db_session.execute(lambda_stmt(lambda: select(Flight).where(Flight.flight_num == flight_num, Flight.departure_airport == from_, Flight.status == "open"))).scalars().first()
+        return str(flight_info(result) if result is not None else None)
+
+def measure(name, lookup, arguments):
+    latencies = []
+    for args in arguments:
+        start = time.perf_counter()
+        lookup(*args)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+    print(f"{name:<34}{np.percentile(latencies, 50):>10.3f}{np.percentile(latencies, 99):>10.3f}{len(latencies) / latencies.sum() * 1000:>10.0f}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the booking lookups with and without indexes and lambda statements")
+    arg_parser.add_argument("--bookings", type=int, default=1000000)
+    arg_parser.add_argument("--flights-per-customer", type=int, default=5)
+    arg_parser.add_argument("--airports", type=int, default=300)
+    arg_parser.add_argument("--queries", type=int, default=500, help="lookups per measurement, without indexes every lookup is a full table scan")
+    args = arg_parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "flights.db")
+    start = time.perf_counter()
+    flight_keys = create_database(db_path, args.bookings, args.flights_per_customer, args.airports)
+    print(f"Generated {args.bookings} bookings in {time.perf_counter() - start:.1f}s")
+    customers = args.bookings // args.flights_per_customer
+    rng = random.Random(1)
+    customer_arguments = [(str(rng.randrange(customers)),) for _ in range(args.queries)]
+    flight_arguments = [rng.choice(flight_keys) for _ in range(args.queries)]
+
+    engine = create_sqlite_engine(db_path, wal=True, pool_size=1)
+    session = scoped_session(sessionmaker(bind=engine))
+    print(f"{'lookup':<34}{'p50 ms':>10}{'p99 ms':>10}{'QPS':>10}")
+    measure("load_user_flight_info (before)", lambda customer_id: load_user_flight_info_query(session, customer_id), customer_arguments)
+    measure("check_flight_status (before)", lambda flight_num, from_: check_flight_status_query(session, flight_num, from_), flight_arguments)
+
+    start = time.perf_counter()
+    ensure_indexes(engine, Base.metadata)
+    print(f"Migration took {time.perf_counter() - start:.1f}s")
+    measure("load_user_flight_info (indexed)", lambda customer_id: load_user_flight_info_query(session, customer_id), customer_arguments)
+    measure("check_flight_status (indexed)", lambda flight_num, from_: check_flight_status_query(session, flight_num, from_), flight_arguments)
+    measure("load_user_flight_info (+lambda)", lambda customer_id: load_user_flight_info_stmt(session, customer_id), customer_arguments)
+    measure("check_flight_status (+lambda)", lambda flight_num, from_: check_flight_status_stmt(session, flight_num, from_), flight_arguments)
+    engine.dispose()
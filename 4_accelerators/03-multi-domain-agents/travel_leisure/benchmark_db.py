@@ -0,0 +1,82 @@
+# Concurrent read/write benchmark of the booking database engines: reader threads look up flights while writer
+# threads change them, once with the previous default engine and once with the pooled WAL engine of db_utils.
+# Runs on a generated copy of the flights table:
+#   python benchmark_db.py --readers 8 --writers 1 --seconds 10
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from db_utils import create_sqlite_engine
+
+
+def create_database(db_path, customers, flights_per_customer):
+    engine = create_engine(f'sqlite:///{db_path}')
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE flights (id INTEGER PRIMARY KEY AUTOINCREMENT, customer_id VARCHAR, ticket_num VARCHAR, flight_num VARCHAR, departure_time DATETIME, status VARCHAR)"))
+        connection.execute(text("INSERT INTO flights (customer_id, ticket_num, flight_num, departure_time, status) VALUES (:customer_id, :ticket_num, :flight_num, '2024-06-01 10:00:00', 'open')"),
+                           [{"customer_id": str(customer), "ticket_num": f"{customer:06d}{i}", "flight_num": f"AA{i:03d}"} for customer in range(customers) for i in range(flights_per_customer)])
+    engine.dispose()
+
+def reader(engine, customers, stop, latencies, errors):
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT * FROM flights WHERE customer_id = :customer_id AND status = 'open'"), {"customer_id": str(random.randrange(customers))}).fetchall()
+            latencies.append(time.perf_counter() - start)
+        except OperationalError:
+            errors.append(1)
+
+def writer(engine, customers, flights_per_customer, stop, latencies, errors):
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            with engine.begin() as connection:
+                ticket_num = f"{random.randrange(customers):06d}{random.randrange(flights_per_customer)}"
+                connection.execute(text("UPDATE flights SET flight_num = :flight_num, departure_time = CURRENT_TIMESTAMP WHERE ticket_num = :ticket_num"), {"flight_num": f"AA{random.randrange(1000):03d}", "ticket_num": ticket_num})
+            latencies.append(time.perf_counter() - start)
+        except OperationalError:
+            errors.append(1)
+
+def run(name, engine, args):
+    stop = threading.Event()
+    read_latencies, write_latencies, read_errors, write_errors = [], [], [], []
+    threads = [threading.Thread(target=reader, args=(engine, args.customers, stop, read_latencies, read_errors)) for _ in range(args.readers)]
+    threads += [threading.Thread(target=writer, args=(engine, args.customers, args.flights_per_customer, stop, write_latencies, write_errors)) for _ in range(args.writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+    p99 = np.percentile(read_latencies, 99) * 1000 if read_latencies else float("nan")
+    print(f"{name:<10}{len(read_latencies) / args.seconds:>10.0f}{p99:>12.2f}{len(read_errors):>10}{len(write_latencies) / args.seconds:>10.0f}{len(write_errors):>10}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark concurrent reads and writes on the booking database engines")
+    arg_parser.add_argument("--readers", type=int, default=8)
+    arg_parser.add_argument("--writers", type=int, default=1)
+    arg_parser.add_argument("--seconds", type=float, default=10)
+    arg_parser.add_argument("--customers", type=int, default=10000)
+    arg_parser.add_argument("--flights-per-customer", type=int, default=5)
+    arg_parser.add_argument("--busy-timeout-ms", type=int, default=1000, help="lock wait before 'database is locked', the same for both engines")
+    args = arg_parser.parse_args()
+
+    print(f"{args.readers} readers, {args.writers} writers, {args.seconds:.0f}s")
+    print(f"{'engine':<10}{'reads/s':>10}{'read p99 ms':>12}{'locked':>10}{'writes/s':>10}{'locked':>10}")
+    work_dir = tempfile.mkdtemp()
+    default_path = os.path.join(work_dir, "default.db")
+    create_database(default_path, args.customers, args.flights_per_customer)
+    run("default", create_engine(f'sqlite:///{default_path}', connect_args={"timeout": args.busy_timeout_ms / 1000, "check_same_thread": False}), args)
+    tuned_path = os.path.join(work_dir, "tuned.db")
+    create_database(tuned_path, args.customers, args.flights_per_customer)
+    run("wal+pool", create_sqlite_engine(tuned_path, wal=True, pool_size=args.readers + args.writers, busy_timeout_ms=args.busy_timeout_ms), args)
@@ -0,0 +1,85 @@
+# Recall@k and QPS benchmark of the approximate HNSW policy index against exact brute force search.
+# Runs offline: queries are perturbed copies of the indexed embeddings, so no embedding calls are made.
+#   python benchmark_search.py
+#   python benchmark_search.py --synthetic-size 1000000 --dim 256 --ef-search 16 32 64 128
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from search_utils import BruteForceIndex, HNSWIndex, normalize_rows, policy_store_is_fresh, load_policy_store
+
+
+def load_policy_embeddings(emb_map_file_path):
+    if policy_store_is_fresh(emb_map_file_path):
+        return np.asarray(load_policy_store(emb_map_file_path)[2])
+    with open(emb_map_file_path) as file:
+        chunks_emb = json.load(file)
+    return normalize_rows(np.array([item['policy_text_embedding'] for item in chunks_emb], dtype=np.float32))
+
+def synthetic_embeddings(size, dim, clusters=1000, seed=0):
+    # Clustered data is closer to real text embeddings than uniform noise, which makes every index look bad
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    embeddings = np.empty((size, dim), dtype=np.float32)
+    batch = 100000
+    for start in range(0, size, batch):
+        end = min(start + batch, size)
+        assignment = rng.integers(0, clusters, end - start)
+        embeddings[start:end] = centers[assignment] + 0.5 * rng.standard_normal((end - start, dim), dtype=np.float32)
+    return normalize_rows(embeddings)
+
+def make_queries(embeddings, num_queries, noise=0.1, seed=1):
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(embeddings), num_queries)
+    queries = np.asarray(embeddings[picks]) + noise * rng.standard_normal((num_queries, embeddings.shape[1]), dtype=np.float32) / np.sqrt(embeddings.shape[1])
+    return normalize_rows(queries)
+
+def measure(index, queries, topk):
+    # Single-query latency is what a tool call sees, so queries are issued one at a time
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.append(index.search(query[np.newaxis, :], topk)[0])
+    elapsed = time.perf_counter() - start
+    return np.array(results), len(queries) / elapsed, elapsed / len(queries) * 1000
+
+def recall_at_k(approximate, exact):
+    hits = sum(len(set(a.tolist()) & set(e.tolist())) for a, e in zip(approximate, exact))
+    return hits / exact.size
+
+def run_benchmark(name, embeddings, num_queries, topk, ef_search_values, m):
+    print(f"\n{name}: {embeddings.shape[0]} vectors of dimension {embeddings.shape[1]}, top {topk}")
+    queries = make_queries(embeddings, num_queries)
+    exact_results, qps, latency = measure(BruteForceIndex(embeddings), queries, topk)
+    print(f"{'index':<22}{'recall@k':>10}{'QPS':>12}{'ms/query':>12}")
+    print(f"{'brute_force':<22}{1.0:>10.3f}{qps:>12.0f}{latency:>12.3f}")
+    start = time.perf_counter()
+    hnsw_index = HNSWIndex(embeddings, m=m)
+    print(f"(HNSW build time {time.perf_counter() - start:.1f}s)")
+    for ef_search in ef_search_values:
+        hnsw_index.ef_search = ef_search
+        results, qps, latency = measure(hnsw_index, queries, topk)
+        print(f"{f'hnsw ef_search={ef_search}':<22}{recall_at_k(results, exact_results):>10.3f}{qps:>12.0f}{latency:>12.3f}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the HNSW policy index against brute force search")
+    arg_parser.add_argument("--policy-files", nargs="*", default=["./data/flight_policy.json", "./data/hotel_policy.json"])
+    arg_parser.add_argument("--synthetic-size", type=int, default=1000000)
+    arg_parser.add_argument("--dim", type=int, default=256, help="dimension of the synthetic vectors")
+    arg_parser.add_argument("--queries", type=int, default=1000)
+    arg_parser.add_argument("--topk", type=int, default=3)
+    arg_parser.add_argument("--hnsw-m", type=int, default=32)
+    arg_parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128])
+    args = arg_parser.parse_args()
+
+    for policy_file in args.policy_files:
+        if not Path(policy_file).exists() and not policy_store_is_fresh(policy_file):
+            print(f"\nSkipping {policy_file}, file not found")
+            continue
+        run_benchmark(policy_file, load_policy_embeddings(policy_file), args.queries, args.topk, args.ef_search, args.hnsw_m)
+    if args.synthetic_size > 0:
+        run_benchmark("synthetic", synthetic_embeddings(args.synthetic_size, args.dim), args.queries, args.topk, args.ef_search, args.hnsw_m)
@@ -0,0 +1,110 @@
+# SQLite engine factory with a connection pool and a PRAGMA profile per use case:
+# the booking databases (flight_db.db, hotel.db) are read and written concurrently by the tool threads and use WAL,
+# read-only analytics databases can be opened with the read-only and immutable URI flags.
+import os
+import sqlite3
+from contextlib import contextmanager
+from urllib.parse import quote
+
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.pool import QueuePool
+
+
+def sqlite_uri(db_path, read_only=False, immutable=False):
+    params = []
+    if read_only:
+        params.append("mode=ro")
+    if immutable:
+        params.append("immutable=1")  # no locking or change detection at all, only for files nobody writes
+    return f"file:{quote(os.path.abspath(db_path))}" + ("?" + "&".join(params) if params else "")
+
+def create_sqlite_engine(db_path, read_only=False, immutable=False, wal=False, pool_size=5, max_overflow=5,
+                         mmap_size=256 * 1024 * 1024, cache_size_kib=64 * 1024, busy_timeout_ms=5000):
+    """
+    Creates a SQLAlchemy engine for a SQLite file.
+
+    Args:
+        db_path (str): path of the database file.
+        read_only (bool): open the file read-only.
+        immutable (bool): also tell SQLite the file never changes, which skips all locking.
+        wal (bool): use the WAL journal, so readers do not block the writer and the writer does not block readers.
+        pool_size (int): connections kept open, size it to the number of threads that query concurrently.
+        max_overflow (int): additional connections opened under load.
+        mmap_size (int): bytes of the file read through memory mapping.
+        cache_size_kib (int): page cache of each connection in KiB.
+        busy_timeout_ms (int): how long a connection waits for a lock before failing with "database is locked".
+    """
+    uri = sqlite_uri(db_path, read_only=read_only, immutable=immutable)
+
+    def connect():
+        # Connections are handed between threads by the pool, never used by two threads at once
+        return sqlite3.connect(uri, uri=True, check_same_thread=False, timeout=busy_timeout_ms / 1000)
+
+    engine = create_engine("sqlite://", creator=connect, poolclass=QueuePool, pool_size=pool_size, max_overflow=max_overflow)
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if wal and not read_only:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")  # durable at checkpoints, safe from corruption with WAL
+        cursor.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+        cursor.execute(f"PRAGMA cache_size={-int(cache_size_kib)}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    return engine
+
+def booking_engine(db_path):
+    # Engine of a booking database, pooled for the tool threads of the agents
+    pool_size = int(os.getenv("SQLITE_POOL_SIZE", os.getenv("TOOL_MAX_WORKERS", 8)))
+    return create_sqlite_engine(
+        db_path,
+        wal=os.getenv("SQLITE_WAL", "true").lower() == "true",
+        pool_size=pool_size,
+        mmap_size=int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+        cache_size_kib=int(os.getenv("SQLITE_CACHE_SIZE_KIB", 64 * 1024)),
+    )
+
+def ensure_indexes(engine, metadata):
+    """
+    Migration for database files created before an index was added to a model: create_all only creates the indexes
+    of tables it creates, this creates every missing index of the metadata on existing tables and analyzes it.
+
+    Returns the names of the indexes created.
+    """
+    inspector = inspect(engine)
+    created = []
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                print(f"Creating index {index.name} on {table.name}")
+                index.create(bind=engine)
+                created.append(index.name)
+    if created:
+        with engine.begin() as connection:
+            for name in created:
+                connection.execute(text(f"ANALYZE {name}"))
+    return created
+
+@contextmanager
+def session_scope(session_registry):
+    """
+    Unit of work of one tool call on a scoped_session registry: a single transaction that is committed once when the
+    block ends and rolled back on any error. The thread's session is removed afterwards, so a failed or half-done
+    change never leaks into the next call served by the same thread.
+
+    Objects loaded inside the block are detached after it, read what the response needs inside the block.
+    """
+    session = session_registry()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session_registry.remove()
@@ -1,16 +1,20 @@
 # Agent class
 ### responsbility definition: expertise, scope, conversation script, style 
-from openai import AzureOpenAI
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey
+from openai import AzureOpenAI, AsyncAzureOpenAI
+from openai.types.chat import ChatCompletionMessage
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Index, lambda_stmt, select
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, scoped_session
 from sqlalchemy.orm import sessionmaker  
 from datetime import datetime  
 import os
 from pathlib import Path  
 import json
 import time
-from scipy import spatial  # for calculating vector similarities for search
+import numpy as np  # for calculating vector similarities for search
+from embedding_utils import EmbeddingCache, EmbeddingBatcher
+from db_utils import booking_engine, ensure_indexes, session_scope
+from search_utils import normalize_rows, build_index, hnsw_index_path, hnsw_index_is_fresh, policy_store_is_fresh, load_policy_store
 from datetime import datetime, timedelta
 from dateutil import parser
 
@@ -27,6 +31,7 @@ import pandas as pd
 from dotenv import load_dotenv
 from azure.core.credentials import AzureKeyCredential  
 import inspect
+from concurrent.futures import ThreadPoolExecutor
 from azure.search.documents import SearchClient  
 from dotenv import load_dotenv
 env_path = Path('.') / 'secrets.env'
@@ -43,37 +48,71 @@ client = AzureOpenAI(
   api_version="2023-12-01-preview",
   azure_endpoint = os.environ.get("AZURE_OPENAI_ENDPOINT")
 )
+async_client = AsyncAzureOpenAI(
+  api_key=os.environ.get("AZURE_OPENAI_API_KEY"),  
+  api_version="2023-12-01-preview",
+  azure_endpoint = os.environ.get("AZURE_OPENAI_ENDPOINT")
+)
 
 sqllite_db_path= os.environ.get("SQLITE_DB_PATH","data/flight_db.db")
-engine = create_engine(f'sqlite:///{sqllite_db_path}') 
+engine = booking_engine(sqllite_db_path)
 class Search_Client():
-    def __init__(self,emb_map_file_path):
-        with open(emb_map_file_path) as file:
-            self.chunks_emb = json.load(file)
+    """
+    Searches policy chunks by embedding similarity.
+
+    Args:
+        emb_map_file_path (str): JSON policy file, or the path it was converted from with search_utils.py.
+        index_type (str): "brute_force" for exact search or "hnsw" for an approximate index. Defaults to POLICY_SEARCH_INDEX.
+        ef_search (int): HNSW candidate list size, higher is more accurate and slower. Defaults to POLICY_HNSW_EF_SEARCH.
+    """
+    def __init__(self,emb_map_file_path, index_type=None, ef_search=None):
+        if policy_store_is_fresh(emb_map_file_path):
+            # Binary store produced offline by search_utils.py, memory-mapped instead of parsed
+            self.ids, self.texts, self.embeddings = load_policy_store(emb_map_file_path)
+        else:
+            with open(emb_map_file_path) as file:
+                chunks_emb = json.load(file)
+            self.ids = [item['id'] for item in chunks_emb]
+            self.texts = [item['policy_text'] for item in chunks_emb]
+            # Embeddings are loaded once into a pre-normalized, contiguous float32 matrix
+            self.embeddings = normalize_rows(np.array([item['policy_text_embedding'] for item in chunks_emb], dtype=np.float32).reshape(len(chunks_emb), -1))
+        index_type = index_type or os.getenv("POLICY_SEARCH_INDEX", "brute_force")
+        index_params = {}
+        if index_type == "hnsw":
+            index_path = hnsw_index_path(emb_map_file_path)
+            index_params = {
+                "m": int(os.getenv("POLICY_HNSW_M", 32)),
+                "ef_search": ef_search or int(os.getenv("POLICY_HNSW_EF_SEARCH", 64)),
+                "index_path": index_path if policy_store_is_fresh(emb_map_file_path) and hnsw_index_is_fresh(emb_map_file_path) else None,
+            }
+        self.index = build_index(self.embeddings, index_type, **index_params)
+
+    def _format_chunks(self, indices):
+        text_content = ""
+        for idx in indices:
+            if idx < 0:  # approximate indexes pad with -1 when fewer results are found
+                continue
+            text_content += f"{self.ids[idx]}\n{self.texts[idx]}\n"
+        return text_content
 
     def find_article(self,question, topk=3):  
         """  
-        Given an input vector and a dictionary of label vectors,  
-        returns the label with the highest cosine similarity to the input vector.  
+        Given a question, returns the topk policy chunks with the highest cosine similarity to the question embedding.  
         """  
         print("question ", question)
-        input_vector = get_embedding(question, model = emb_engine)        
-        # Compute cosine similarity between input vector and each label vector
-        cosine_list=[]  
-        for item in self.chunks_emb:  
-            #by default, we use embedding for the entire content of the topic (plus topic descrition).
-            # If you you want to use embedding on just topic name and description use this code cosine_sim = cosine_similarity(input_vector, vector[0])
-            cosine_sim = 1 - spatial.distance.cosine(input_vector, item['policy_text_embedding'])
-            cosine_list.append((item['id'],item['policy_text'],cosine_sim ))
-        cosine_list.sort(key=lambda x:x[2],reverse=True)
-        cosine_list= cosine_list[:topk]
-        best_chunks =[chunk[0] for chunk in cosine_list]
-        contents = [chunk[1] for chunk in cosine_list]
-        text_content = ""
-        for chunk_id, content in zip(best_chunks, contents):
-            text_content += f"{chunk_id}\n{content}\n"
+        input_vector = normalize_rows(get_embedding(question, model = emb_engine))
+        return self._format_chunks(self.index.search(input_vector[np.newaxis, :], topk)[0])
+
+    def find_articles(self, questions, topk=3):
+        """
+        Batched version of find_article: all questions are embedded in one request and searched together.
+        Returns a list with the text content for each question.
+        """
+        if len(questions) == 0:
+            return []
+        input_vectors = normalize_rows(get_embeddings(questions, model = emb_engine))
+        return [self._format_chunks(indices) for indices in self.index.search(input_vectors, topk)]
 
-        return text_content
 def check_args(function, args):
     sig = inspect.signature(function)
     params = sig.parameters
@@ -87,9 +126,29 @@ def check_args(function, args):
         if param.default is param.empty and name not in args:
             return False
 
+embedding_cache_redis = None
+if os.getenv("EMBEDDING_CACHE_REDIS_URL"):
+    import redis  # only needed when the shared cache tier is enabled
+    embedding_cache_redis = redis.from_url(os.getenv("EMBEDDING_CACHE_REDIS_URL"))
+embedding_cache = EmbeddingCache(max_size=int(os.getenv("EMBEDDING_CACHE_SIZE", 10000)), ttl=float(os.getenv("EMBEDDING_CACHE_TTL", 86400)), redis_client=embedding_cache_redis)
+# Concurrent sessions share embedding requests instead of sending one single-item request each
+embedding_batcher = EmbeddingBatcher(async_client, model=emb_engine, max_batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", 64)), max_wait=float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", 5)) / 1000)
+
 def get_embedding(text, model=emb_engine):
    text = text.replace("\n", " ")
-   return client.embeddings.create(input = [text], model=model).data[0].embedding
+   return embedding_cache.get_or_compute(model, text, lambda: embedding_batcher.embed_sync(text, model))
+
+def get_embeddings(texts, model=emb_engine):
+   texts = [text.replace("\n", " ") for text in texts]
+   embeddings = [embedding_cache.get(model, text) for text in texts]
+   missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+   if missing:
+      # Only the cache misses are sent, in one request
+      response = client.embeddings.create(input = [texts[i] for i in missing], model=model)
+      for item in response.data:
+         embeddings[missing[item.index]] = item.embedding
+         embedding_cache.set(model, texts[missing[item.index]], item.embedding)
+   return embeddings
 
 faiss_search_client = Search_Client("./data/flight_policy.json")
 
@@ -130,20 +189,21 @@ def search_airline_knowledgebase(search_query):
 
 def check_flight_status(flight_num, from_):
     # Query the SQLite database for the flight status
-    result = session.query(Flight).filter_by(flight_num=flight_num, departure_airport=from_, status="open").first()
-
-    if result is not None:
-        # Assuming you want to return a string containing relevant flight information
-        output = {
-            'flight_num': result.flight_num,
-            'departure_airport': result.departure_airport,
-            'arrival_airport': result.arrival_airport,
-            'departure_time': result.departure_time.strftime('%Y-%m-%d %H:%M'),
-            'arrival_time': result.arrival_time.strftime('%Y-%m-%d %H:%M'),
-            'status': result.status
-        }
-    else:
-        output = f"Cannot find status for the flight {flight_num} from {from_}"
+    with session_scope(session) as db_session:
+        result = db_session.execute(open_flight_stmt(flight_num, from_)).scalars().first()
+
+        if result is not None:
+            # Assuming you want to return a string containing relevant flight information
+            output = {
+                'flight_num': result.flight_num,
+                'departure_airport': result.departure_airport,
+                'arrival_airport': result.arrival_airport,
+                'departure_time': result.departure_time.strftime('%Y-%m-%d %H:%M'),
+                'arrival_time': result.arrival_time.strftime('%Y-%m-%d %H:%M'),
+                'status': result.status
+            }
+        else:
+            output = f"Cannot find status for the flight {flight_num} from {from_}"
 
     return str(output)
 
@@ -190,11 +250,29 @@ class Flight(Base):
     ticket_class = Column(String)
     gate = Column(String)
     status = Column(String)
+    # One index per lookup of the tools, see the statements below
+    __table_args__ = (
+        Index('ix_flights_customer_id_status', 'customer_id', 'status'),
+        Index('ix_flights_ticket_num_status', 'ticket_num', 'status'),
+        Index('ix_flights_flight_num_departure_airport_status', 'flight_num', 'departure_airport', 'status'),
+    )
+
+# Lookups of the tools as lambda statements: SQLAlchemy caches the compiled SQL per lambda and only binds the new values
+def customer_flights_stmt(customer_id):
+    return lambda_stmt(lambda: select(Flight).where(Flight.customer_id == customer_id, Flight.status == "open"))
+
+def open_ticket_stmt(ticket_num):
+    return lambda_stmt(lambda: select(Flight).where(Flight.ticket_num == ticket_num, Flight.status == "open"))
+
+def open_flight_stmt(flight_num, departure_airport):
+    return lambda_stmt(lambda: select(Flight).where(Flight.flight_num == flight_num, Flight.departure_airport == departure_airport, Flight.status == "open"))
   
 # Set up the SQLite database  
 Base.metadata.create_all(engine)  
+ensure_indexes(engine, Base.metadata)  # database files created before the indexes were added
 Session = sessionmaker(bind=engine)  
-session = Session()  
+# Tools run in worker threads, scoped_session gives each thread its own session and session_scope makes each tool call one unit of work
+session = scoped_session(Session)  
 # Example usage  
 # new_confirmation = confirm_flight_change("1234567890", "AA123", "2023-08-01 08:00", "2023-08-01 10:00")  
 # print(new_confirmation)  
@@ -202,11 +280,15 @@ session = Session()
 def confirm_flight_change(current_ticket_number, new_flight_num, new_departure_time, new_arrival_time):  
     charge = 80  
   
-    # Retrieve current flight  
-    old_flight = session.query(Flight).filter_by(ticket_num=current_ticket_number, status="open").first()  
-    if old_flight:  
-        old_flight.status = "cancelled"  
-        session.commit()  
+    # Cancelling the current flight and creating the new one is a single transaction, either both happen or neither  
+    with session_scope(session) as db_session:  
+        old_flight = db_session.execute(open_ticket_stmt(current_ticket_number)).scalars().first()  
+        if old_flight is None:  
+            return "Could not find the current ticket to change."  
+        # Only cancel the flight if it is still open, a concurrent change of the same ticket makes this a no-op  
+        cancelled = db_session.query(Flight).filter_by(id=old_flight.id, status="open").update({"status": "cancelled"}, synchronize_session=False)  
+        if cancelled == 0:  
+            return "Could not find the current ticket to change."  
         print("Updated old flight status to cancelled")  
   
         # Create a new flight  
@@ -226,14 +308,11 @@ def confirm_flight_change(current_ticket_number, new_flight_num, new_departure_t
             gate=old_flight.gate,  # Assuming same gate for simplicity  
             status="open"  
         )  
-        session.add(new_flight)  
-        session.commit()  
-          
-        return f"""Your new flight now is {new_flight_num} departing from {new_flight.departure_airport} to {new_flight.arrival_airport}. Your new departure time is {new_departure_time} and arrival time is {new_arrival_time}. Your new ticket number is {new_ticket_num}.  
-        Your credit card has been charged with an amount of ${charge} dollars for fare difference."""  
+        db_session.add(new_flight)  
+        departure_airport, arrival_airport = new_flight.departure_airport, new_flight.arrival_airport  
   
-    else:  
-        return "Could not find the current ticket to change."  
+    return f"""Your new flight now is {new_flight_num} departing from {departure_airport} to {arrival_airport}. Your new departure time is {new_departure_time} and arrival time is {new_arrival_time}. Your new ticket number is {new_ticket_num}.  
+    Your credit card has been charged with an amount of ${charge} dollars for fare difference."""  
   
 
 def check_change_booking(current_ticket_number, current_flight_num, new_flight_num, from_):
@@ -246,24 +325,23 @@ def load_user_flight_info(user_id):
     # Load flight information from SQLite using SQLAlchemy
     user_id=user_id.strip()
     print("user_id", user_id)
-    matched_flights = session.query(Flight).filter_by(customer_id=user_id, status="open").all()
-    
     flights_info = []
-    for flight in matched_flights:
-        flight_info = {
-            'airline': flight.airline,  # Assuming you have this field in the Flight model.
-            'flight_num': flight.flight_num,
-            'seat_num': flight.seat_num,
-            'departure_airport': flight.departure_airport,
-            'arrival_airport': flight.arrival_airport,
-            'departure_time': flight.departure_time.strftime('%Y-%m-%d %H:%M'),
-            'arrival_time': flight.arrival_time.strftime('%Y-%m-%d %H:%M'),
-            'ticket_class': flight.ticket_class,
-            'ticket_num': flight.ticket_num,
-            'gate': flight.gate,
-            'status': flight.status
-        }
-        flights_info.append(flight_info)
+    with session_scope(session) as db_session:
+        for flight in db_session.execute(customer_flights_stmt(user_id)).scalars():
+            flight_info = {
+                'airline': flight.airline,  # Assuming you have this field in the Flight model.
+                'flight_num': flight.flight_num,
+                'seat_num': flight.seat_num,
+                'departure_airport': flight.departure_airport,
+                'arrival_airport': flight.arrival_airport,
+                'departure_time': flight.departure_time.strftime('%Y-%m-%d %H:%M'),
+                'arrival_time': flight.arrival_time.strftime('%Y-%m-%d %H:%M'),
+                'ticket_class': flight.ticket_class,
+                'ticket_num': flight.ticket_num,
+                'gate': flight.gate,
+                'status': flight.status
+            }
+            flights_info.append(flight_info)
 
     if not flights_info:
         return "Sorry, we cannot find any flight information for you."
@@ -445,6 +523,30 @@ FLIGHT_FUNCTIONS_SPEC= [
 
 
 
+def stream_chat_completion(**kwargs):
+    # Streams a chat completion, yields ("token", text) for each content delta and finally ("message", message)
+    # with the tool call deltas assembled into a regular assistant message
+    content = ""
+    tool_calls = {}
+    for chunk in client.chat.completions.create(stream=True, **kwargs):
+        if not chunk.choices: # Azure sends content filter results in chunks without choices
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            content += delta.content
+            yield "token", delta.content
+        for tool_call_delta in delta.tool_calls or []:
+            tool_call = tool_calls.setdefault(tool_call_delta.index, {"id": None, "type": "function", "function": {"name": "", "arguments": ""}})
+            if tool_call_delta.id:
+                tool_call["id"] = tool_call_delta.id
+            if tool_call_delta.function is not None:
+                tool_call["function"]["name"] += tool_call_delta.function.name or ""
+                tool_call["function"]["arguments"] += tool_call_delta.function.arguments or ""
+    yield "message", ChatCompletionMessage(role="assistant", content=content, tool_calls=[tool_calls[index] for index in sorted(tool_calls)] or None)
+
+# Tool calls from one assistant turn run concurrently in this bounded pool
+tool_executor = ThreadPoolExecutor(max_workers=int(os.getenv("TOOL_MAX_WORKERS", 8)))
+
 class Smart_Agent():
     """
     Agent that can use other agents and tools to answer questions.
@@ -488,21 +590,35 @@ class Smart_Agent():
     def run(self, user_input, conversation=None):
         if user_input is None: #if no input return init message
             return self.init_history, self.init_history[1]["content"]
+        for event in self.run_stream(user_input, conversation):
+            if event["type"] == "done":
+                return event["request_help"], event["conversation"], event["content"]
+
+    def run_stream(self, user_input, conversation=None):
+        """
+        Same as run, but yields events while the agent works:
+        {"type": "token", "content": ...} for each piece of assistant text,
+        {"type": "tool_call", "name": ...} and {"type": "tool_result", "name": ..., "content": ...} around each tool call,
+        and finally {"type": "done", "request_help": ..., "conversation": ..., "content": ...}.
+        """
         if conversation is None: #if no history return init message
             conversation = self.init_history.copy()
         conversation.append({"role": "user", "content": user_input})
         request_help = False
         while True:
-            response = client.chat.completions.create(
+            for event_type, value in stream_chat_completion(
                 model=self.engine, # The deployment name you chose when you deployed the GPT-35-turbo or GPT-4 model.
                 messages=conversation,
             tools=self.functions_spec,
             tool_choice='auto',
             max_tokens=200,
 
-            )
+            ):
+                if event_type == "token":
+                    yield {"type": "token", "content": value}
+                else:
+                    response_message = value
             
-            response_message = response.choices[0].message
             if response_message.content is None:
                 response_message.content = ""
 
@@ -513,19 +629,19 @@ class Smart_Agent():
             # Step 2: check if GPT wanted to call a function
             if  tool_calls:
                 conversation.append(response_message)  # extend conversation with assistant's reply
+                # Step 3: validate the calls and start the valid ones concurrently in the tool thread pool
+                # Note: the JSON response may not always be valid; be sure to handle errors
+                pending_calls = []
                 for tool_call in tool_calls:
                     function_name = tool_call.function.name
                     print("Recommended Function call:")
                     print(function_name)
                     print()
-                
-                    # Step 3: call the function
-                    # Note: the JSON response may not always be valid; be sure to handle errors
-                                    
+
                     # verify function exists
                     if function_name not in self.functions_list:
                         # raise Exception("Function " + function_name + " does not exist")
-                        conversation.pop()
+                        pending_calls.append((tool_call, None))
                         continue
                     function_to_call = self.functions_list[function_name]
                     
@@ -534,12 +650,21 @@ class Smart_Agent():
 
                     if check_args(function_to_call, function_args) is False:
                         # raise Exception("Invalid number of arguments for function: " + function_name)
-                        conversation.pop()
+                        pending_calls.append((tool_call, None))
                         continue
 
-                    
-                    # print("beginning function call")
-                    function_response = str(function_to_call(**function_args))
+                    pending_calls.append((tool_call, tool_executor.submit(function_to_call, **function_args)))
+                    yield {"type": "tool_call", "name": function_name}
+                    if function_name=="get_help": #the conversation is handed over, later calls are not run
+                        break
+
+                # Step 4: collect the results in the original tool call order, the turn takes as long as the slowest tool
+                for tool_call, future in pending_calls:
+                    if future is None:
+                        conversation.pop()
+                        continue
+                    function_name = tool_call.function.name
+                    function_response = str(future.result())
 
                     if function_name=="get_help": #scenario where the agent asks for help
                         summary_conversation = []
@@ -548,11 +673,13 @@ class Smart_Agent():
                             if message.get("role") != "system" and message.get("role") != "tool" and len(message.get("content"))>0:
                                 summary_conversation.append({"role":message.get("role"), "content":message.get("content")})
                         summary_conversation.pop() #remove the last message which is the agent asking for help
-                        return True, summary_conversation, function_response
+                        yield {"type": "done", "request_help": True, "conversation": summary_conversation, "content": function_response}
+                        return
 
                     print("Output of function call:")
                     print(function_response)
                     print()
+                    yield {"type": "tool_result", "name": function_name, "content": function_response}
                 
                     conversation.append(
                         {
@@ -571,4 +698,4 @@ class Smart_Agent():
         conversation.append(response_message)
         assistant_response = response_message.content
 
-        return request_help, conversation, assistant_response
+        yield {"type": "done", "request_help": request_help, "conversation": conversation, "content": assistant_response}
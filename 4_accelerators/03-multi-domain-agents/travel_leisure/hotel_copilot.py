@@ -1,5 +1,6 @@
 import streamlit as st
 from streamlit_extras.add_vertical_space import add_vertical_space
+from streamlit_utils import stream_agent_response
 from hotel_copilot_utils import Smart_Agent, HOTEL_PERSONA, HOTEL_AVAILABLE_FUNCTIONS, HOTEL_FUNCTIONS_SPEC
 print(HOTEL_PERSONA)
 import json
@@ -59,8 +60,9 @@ else:
 if user_input:
     with st.chat_message("user"):
         st.markdown(user_input)
-    query_used, history, agent_response = agent.run(user_input=user_input, conversation=history)
     with st.chat_message("assistant"):
-        st.markdown(agent_response)
+        result = {}
+        stream_agent_response(agent.run_stream(user_input=user_input, conversation=history), result)
+    query_used, history, agent_response = result["request_help"], result["conversation"], result["content"]
 
 st.session_state['history'] = history
\ No newline at end of file
@@ -3,9 +3,10 @@
 from openai import AzureOpenAI
 from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, scoped_session
 from sqlalchemy.orm import sessionmaker  
 from datetime import datetime  
+from db_utils import booking_engine, ensure_indexes, session_scope
 import os
 from pathlib import Path  
 import json
@@ -50,7 +51,7 @@ def search_hotel_knowledgebase(search_query):
     print("question ", search_query)
     return faiss_search_client.find_article(search_query, topk=3)
 
-from sqlalchemy import create_engine, Column, String, Integer, DateTime, ForeignKey
+from sqlalchemy import create_engine, Column, String, Integer, DateTime, ForeignKey, Index, lambda_stmt, select
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -72,11 +73,25 @@ class Reservation(Base):
     check_out_date = Column(DateTime)  
     status = Column(String)  # e.g., "booked", "cancelled", "checked_in", "checked_out"  
     # Add any other relevant fields that describe the room or the reservation
-engine = create_engine('sqlite:///data/hotel.db')
+    # Lookups by id use the primary key, lookups by customer this index
+    __table_args__ = (
+        Index('ix_reservations_customer_id_status', 'customer_id', 'status'),
+    )
+
+# Lookups of the tools as lambda statements: SQLAlchemy caches the compiled SQL per lambda and only binds the new values
+def customer_reservations_stmt(customer_id):
+    return lambda_stmt(lambda: select(Reservation).where(Reservation.customer_id == customer_id, Reservation.status == "booked"))
+
+def booked_reservation_stmt(reservation_id):
+    return lambda_stmt(lambda: select(Reservation).where(Reservation.id == reservation_id, Reservation.status == "booked"))
+
+engine = booking_engine('data/hotel.db')
 
 Base.metadata.create_all(engine)  
+ensure_indexes(engine, Base.metadata)  # database files created before the indexes were added
 Session = sessionmaker(bind=engine)  
-session = Session()  
+# Tools run in worker threads, scoped_session gives each thread its own session and session_scope makes each tool call one unit of work
+session = scoped_session(Session)  
 def get_help(user_request):
     return f"{user_request}"
 
@@ -84,21 +99,22 @@ def get_help(user_request):
 # This function should query the database for the reservation status instead of flight status
 def check_reservation_status(reservation_id):
     # Query the SQLite database for the reservation status
-    result = session.query(Reservation).filter_by(id=reservation_id, status="booked").first()
-
-    if result is not None:
-        # Assuming you want to return a string containing relevant reservation information
-        output = {
-            'reservation_id': result.id,
-            'customer_id': result.customer_id,
-            'room_type': result.room_type,
-            'hotel_id': result.hotel_id,
-            'check_in_date': result.check_in_date.strftime('%Y-%m-%d'),
-            'check_out_date': result.check_out_date.strftime('%Y-%m-%d'),
-            'status': result.status
-        }
-    else:
-        output = f"Cannot find status for the reservation with ID {reservation_id}"
+    with session_scope(session) as db_session:
+        result = db_session.execute(booked_reservation_stmt(reservation_id)).scalars().first()
+
+        if result is not None:
+            # Assuming you want to return a string containing relevant reservation information
+            output = {
+                'reservation_id': result.id,
+                'customer_id': result.customer_id,
+                'room_type': result.room_type,
+                'hotel_id': result.hotel_id,
+                'check_in_date': result.check_in_date.strftime('%Y-%m-%d'),
+                'check_out_date': result.check_out_date.strftime('%Y-%m-%d'),
+                'status': result.status
+            }
+        else:
+            output = f"Cannot find status for the reservation with ID {reservation_id}"
 
     return str(output)
 
@@ -116,11 +132,15 @@ def query_rooms(hotel_id, check_in_date, check_out_date):
 def confirm_reservation_change(current_reservation_id, new_room_type, new_check_in_date, new_check_out_date):
     charge = 50  # Assume a fixed change fee
   
-    # Retrieve current reservation
-    old_reservation = session.query(Reservation).filter_by(id=current_reservation_id, status="booked").first()  
-    if old_reservation:  
-        old_reservation.status = "cancelled"  
-        session.commit()  
+    # Cancelling the current reservation and booking the new one is a single transaction, either both happen or neither
+    with session_scope(session) as db_session:  
+        old_reservation = db_session.execute(booked_reservation_stmt(current_reservation_id)).scalars().first()  
+        if old_reservation is None:  
+            return "Could not find the current reservation to change."
+        # Only cancel the reservation if it is still booked, a concurrent change of the same reservation makes this a no-op
+        cancelled = db_session.query(Reservation).filter_by(id=old_reservation.id, status="booked").update({"status": "cancelled"}, synchronize_session=False)  
+        if cancelled == 0:  
+            return "Could not find the current reservation to change."
   
         # Create a new reservation
         new_reservation_id = str(random.randint(100000, 999999))  
@@ -133,13 +153,9 @@ def confirm_reservation_change(current_reservation_id, new_room_type, new_check_
             check_out_date=datetime.strptime(new_check_out_date, '%Y-%m-%d'),  
             status="booked"  
         )  
-        session.add(new_reservation)  
-        session.commit()  
-  
-        return f"Your new reservation for a {new_room_type} room is confirmed. Check-in date is {new_check_in_date} and check-out date is {new_check_out_date}. Your new reservation ID is {new_reservation_id}. A charge of ${charge} has been applied for the change."
+        db_session.add(new_reservation)  
   
-    else:  
-        return "Could not find the current reservation to change."
+    return f"Your new reservation for a {new_room_type} room is confirmed. Check-in date is {new_check_in_date} and check-out date is {new_check_out_date}. Your new reservation ID is {new_reservation_id}. A charge of ${charge} has been applied for the change."
 
 # This function should check the feasibility and outcome of a reservation change
 def check_change_reservation(current_reservation_id, new_check_in_date, new_check_out_date, new_room_type):
@@ -150,19 +166,18 @@ def check_change_reservation(current_reservation_id, new_check_in_date, new_chec
 # This function should load user reservation information instead of flight information
 def load_user_reservation_info(user_id):
     user_id = user_id.strip()
-    matched_reservations = session.query(Reservation).filter_by(customer_id=user_id, status="booked").all()
-    
     reservations_info = []
-    for reservation in matched_reservations:
-        reservation_info = {
-            'room_type': reservation.room_type,
-            'hotel_id': reservation.hotel_id,
-            'check_in_date': reservation.check_in_date.strftime('%Y-%m-%d'),
-            'check_out_date': reservation.check_out_date.strftime('%Y-%m-%d'),
-            'reservation_id': reservation.id,
-            'status': reservation.status
-        }
-        reservations_info.append(reservation_info)
+    with session_scope(session) as db_session:
+        for reservation in db_session.execute(customer_reservations_stmt(user_id)).scalars():
+            reservation_info = {
+                'room_type': reservation.room_type,
+                'hotel_id': reservation.hotel_id,
+                'check_in_date': reservation.check_in_date.strftime('%Y-%m-%d'),
+                'check_out_date': reservation.check_out_date.strftime('%Y-%m-%d'),
+                'reservation_id': reservation.id,
+                'status': reservation.status
+            }
+            reservations_info.append(reservation_info)
 
     if not reservations_info:
         return "Sorry, we cannot find any reservation information for you."
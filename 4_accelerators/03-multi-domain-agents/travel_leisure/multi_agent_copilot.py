@@ -1,5 +1,6 @@
 import streamlit as st
 from streamlit_extras.add_vertical_space import add_vertical_space
+from streamlit_utils import stream_agent_response
 from multi_agent_utils import Agent_Runner,Smart_Agent, GENERALIST_PERSONA, GENERALIST_FUNCTION_SPEC, GENERALIST_AVAILABLE_FUNCTIONS, FLIGHT_PERSONA, HOTEL_PERSONA, FLIGHT_AVAILABLE_FUNCTIONS, FLIGHT_FUNCTIONS_SPEC, HOTEL_AVAILABLE_FUNCTIONS, HOTEL_FUNCTIONS_SPEC
 import json
 with open('./data/user_profile.json') as f:
@@ -66,9 +67,10 @@ else:
 if user_input:
     with st.chat_message("user"):
         st.markdown(user_input)
-    _, history, agent_response = agent_runner.run(user_input=user_input, conversation=history)
     with st.chat_message("assistant"):
-        st.markdown(agent_response)
+        result = {}
+        stream_agent_response(agent_runner.run_stream(user_input=user_input, conversation=history), result)
+    history, agent_response = result["conversation"], result["content"]
 
 st.session_state['history'] = history
 st.session_state['starting_agent_name'] = agent_runner.active_agent.name
@@ -135,5 +135,16 @@ class Agent_Runner():
             
             get_help, conversation, assistant_response = self.active_agent.run(user_input=user_input, conversation=conversation)
         return  get_help, conversation, assistant_response
+    def run_stream(self,user_input, conversation=None):
+        # Streaming version of run, forwards the events of the active agent and announces hand-overs with an agent_change event
+        for event in self.active_agent.run_stream(user_input=user_input, conversation=conversation):
+            if event["type"] == "done" and event["request_help"]: #Agent signal to ask for help. Conversation history is reduced
+                print("get help!")
+                self.revaluate_agent_assignment(event["content"])
+                yield {"type": "agent_change", "name": self.active_agent.name}
+                conversation=  event["conversation"]+self.active_agent.init_history
+                yield from self.active_agent.run_stream(user_input=user_input, conversation=conversation)
+                return
+            yield event
 
 
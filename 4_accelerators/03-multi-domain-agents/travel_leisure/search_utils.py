@@ -0,0 +1,160 @@
+# Vector search helpers shared by the policy knowledge base search clients.
+# Run this file as a script to convert a JSON policy embedding file into the binary store loaded by Search_Client:
+#   python search_utils.py ./data/flight_policy.json
+# Add --index hnsw to also build and save the approximate nearest neighbour index next to the store.
+import argparse
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+
+def normalize_rows(matrix):
+    # L2-normalize each row so that cosine similarity becomes a plain dot product
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+def topk_indices(scores, topk):
+    # argpartition selects the top k in linear time, only those k are then sorted
+    topk = min(topk, scores.shape[-1])
+    if topk <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+    candidates = np.argpartition(-scores, topk - 1, axis=-1)[..., :topk]
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=-1), axis=-1)
+    return np.take_along_axis(candidates, order, axis=-1)
+
+class BruteForceIndex():
+    """
+    Exact search over the normalized embedding matrix, used as the reference for the approximate indexes.
+    """
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    def search(self, query_vectors, topk):
+        scores = query_vectors @ self.embeddings.T
+        return topk_indices(scores, topk)
+
+class HNSWIndex():
+    """
+    Approximate search with a faiss HNSW graph over inner product (cosine similarity on normalized vectors).
+
+    Args:
+        embeddings: normalized float32 matrix, one row per chunk.
+        m (int): number of graph neighbours per node. Higher values improve recall at the cost of memory and build time.
+        ef_construction (int): candidate list size while building the graph.
+        ef_search (int): candidate list size at query time, the main recall/latency trade-off.
+        index_path (str): optional file to load the graph from instead of building it.
+    """
+    def __init__(self, embeddings, m=32, ef_construction=200, ef_search=64, index_path=None):
+        import faiss  # only needed when the approximate index is enabled
+        self.index = None
+        if index_path is not None and Path(index_path).exists():
+            self.index = faiss.read_index(str(index_path))
+            if self.index.ntotal != len(embeddings) or self.index.d != embeddings.shape[1]:
+                print(f"HNSW index {index_path} does not match the embeddings, rebuilding it")
+                self.index = None
+        if self.index is None:
+            self.index = faiss.IndexHNSWFlat(embeddings.shape[1], m, faiss.METRIC_INNER_PRODUCT)
+            self.index.hnsw.efConstruction = ef_construction
+            self.index.add(np.ascontiguousarray(embeddings, dtype=np.float32))
+        self.ef_search = ef_search
+
+    @property
+    def ef_search(self):
+        return self.index.hnsw.efSearch
+
+    @ef_search.setter
+    def ef_search(self, value):
+        self.index.hnsw.efSearch = value
+
+    def save(self, index_path):
+        import faiss
+        faiss.write_index(self.index, str(index_path))
+
+    def search(self, query_vectors, topk):
+        topk = min(topk, self.index.ntotal)
+        if topk <= 0:
+            return np.empty((len(query_vectors), 0), dtype=np.int64)
+        _, indices = self.index.search(np.ascontiguousarray(query_vectors, dtype=np.float32), topk)
+        return indices
+
+def build_index(embeddings, index_type="brute_force", **index_params):
+    if index_type == "brute_force":
+        return BruteForceIndex(embeddings)
+    if index_type == "hnsw":
+        return HNSWIndex(embeddings, **index_params)
+    raise ValueError(f"Unknown search index type {index_type}, expected brute_force or hnsw")
+
+def policy_store_paths(emb_map_file_path):
+    # data/flight_policy.json -> data/flight_policy.npy (embedding matrix) and data/flight_policy.meta.json (ids and text)
+    path = Path(emb_map_file_path)
+    return path.with_suffix(".npy"), path.with_suffix(".meta.json")
+
+def hnsw_index_path(emb_map_file_path):
+    return Path(emb_map_file_path).with_suffix(".hnsw")
+
+def hnsw_index_is_fresh(emb_map_file_path):
+    # The saved graph returns row ids of the matrix it was built from, so it is only used when not older than the .npy
+    matrix_path, _ = policy_store_paths(emb_map_file_path)
+    index_path = hnsw_index_path(emb_map_file_path)
+    if not (matrix_path.exists() and index_path.exists()):
+        return False
+    return index_path.stat().st_mtime >= matrix_path.stat().st_mtime
+
+def convert_policy_file(emb_map_file_path):
+    with open(emb_map_file_path) as file:
+        chunks_emb = json.load(file)
+    embeddings = normalize_rows(np.array([item['policy_text_embedding'] for item in chunks_emb], dtype=np.float32).reshape(len(chunks_emb), -1))
+    meta = {
+        "ids": [item['id'] for item in chunks_emb],
+        "texts": [item['policy_text'] for item in chunks_emb],
+    }
+    matrix_path, meta_path = policy_store_paths(emb_map_file_path)
+    # Write to temporary files and rename, so processes that already mapped the old store keep a consistent view
+    tmp_matrix_path = matrix_path.with_name(matrix_path.name + ".tmp")
+    with open(tmp_matrix_path, "wb") as file:
+        np.save(file, embeddings)
+    tmp_meta_path = meta_path.with_name(meta_path.name + ".tmp")
+    with open(tmp_meta_path, "w") as file:
+        json.dump(meta, file)
+    # An index saved for the previous matrix would return row ids of other policies
+    hnsw_index_path(emb_map_file_path).unlink(missing_ok=True)
+    os.replace(tmp_matrix_path, matrix_path)
+    os.replace(tmp_meta_path, meta_path)
+    return matrix_path, meta_path
+
+def policy_store_is_fresh(emb_map_file_path):
+    # The binary store is used only when it exists and is not older than the JSON file it was converted from
+    matrix_path, meta_path = policy_store_paths(emb_map_file_path)
+    if not (matrix_path.exists() and meta_path.exists()):
+        return False
+    source_path = Path(emb_map_file_path)
+    return not source_path.exists() or source_path.stat().st_mtime <= matrix_path.stat().st_mtime
+
+def load_policy_store(emb_map_file_path):
+    # The matrix is memory-mapped read-only: worker processes share one page-cached copy and nothing is parsed at start up
+    matrix_path, meta_path = policy_store_paths(emb_map_file_path)
+    with open(meta_path) as file:
+        meta = json.load(file)
+    embeddings = np.load(matrix_path, mmap_mode="r")
+    return meta["ids"], meta["texts"], embeddings
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Convert JSON policy embedding files into memory-mappable binary stores")
+    arg_parser.add_argument("files", nargs="+", help="JSON files with id, policy_text and policy_text_embedding fields")
+    arg_parser.add_argument("--index", choices=["brute_force", "hnsw"], default="brute_force", help="also build and save an approximate index")
+    arg_parser.add_argument("--hnsw-m", type=int, default=32)
+    arg_parser.add_argument("--hnsw-ef-construction", type=int, default=200)
+    args = arg_parser.parse_args()
+    for emb_map_file_path in args.files:
+        matrix_path, meta_path = convert_policy_file(emb_map_file_path)
+        print(f"Converted {emb_map_file_path} to {matrix_path} and {meta_path}")
+        if args.index == "hnsw":
+            _, _, embeddings = load_policy_store(emb_map_file_path)
+            index_path = hnsw_index_path(emb_map_file_path)
+            HNSWIndex(embeddings, m=args.hnsw_m, ef_construction=args.hnsw_ef_construction).save(index_path)
+            print(f"Saved HNSW index to {index_path}")
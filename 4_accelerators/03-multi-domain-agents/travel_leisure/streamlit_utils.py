@@ -0,0 +1,26 @@
+import streamlit as st
+
+
+def stream_agent_response(events, result):
+    # Writes assistant tokens as they arrive, shows tool progress underneath and keeps the final "done" event in result
+    progress = st.empty()
+    def tokens():
+        streamed_text = False
+        for event in events:
+            if event["type"] == "token":
+                streamed_text = True
+                yield event["content"]
+            elif event["type"] == "tool_call":
+                progress.caption(f"Running {event['name']}...")
+                if streamed_text:
+                    streamed_text = False
+                    yield "\n\n"
+            elif event["type"] == "agent_change":
+                progress.caption(f"Transferring you to {event['name']}...")
+            elif event["type"] == "done":
+                result.update(event)
+        progress.empty()
+    st.write_stream(tokens())
+    # The hand-off message of get_help is only in the "done" event, it is never streamed as tokens
+    if result.get("request_help") and result.get("content"):
+        st.markdown(result["content"])
@@ -0,0 +1,132 @@
+# Concurrent booking-change stress test: worker threads change random tickets the way confirm_flight_change does,
+# once with a single session shared by all threads and two commits per change (the previous tool code), and once with
+# one session_scope unit of work per change. Tickets are drawn from a shared pool, so threads regularly race on the
+# same ticket. After each run the database is checked for cross-talk: every customer must still hold the same number
+# of open flights and every cancelled ticket must have exactly one replacement of the same customer.
+#   python stress_test_bookings.py --threads 8 --changes 2000
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from sqlalchemy import Column, Integer, String, create_engine, text
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from db_utils import create_sqlite_engine, session_scope
+
+Base = declarative_base()
+
+class Flight(Base):
+    __tablename__ = 'flights'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    customer_id = Column(String)
+    ticket_num = Column(String)
+    flight_num = Column(String)
+    replaces = Column(String)  # ticket number of the cancelled flight, only used by the consistency check
+    status = Column(String)
+
+
+def create_database(db_path, customers, flights_per_customer):
+    engine = create_engine(f'sqlite:///{db_path}')
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(Flight.__table__.insert(), [{"customer_id": str(customer), "ticket_num": f"{customer:06d}{i}", "flight_num": f"AA{i:03d}", "status": "open"}
+                                                       for customer in range(customers) for i in range(flights_per_customer)])
+    engine.dispose()
+
+def new_flight(old_flight):
+    ticket_num = str(random.randint(1000000000, 9999999999))
+    return Flight(id=int(ticket_num), ticket_num=ticket_num, customer_id=old_flight.customer_id, flight_num=f"AA{random.randrange(1000):03d}", replaces=old_flight.ticket_num, status="open")
+
+def change_shared(session, ticket_num):
+    # Previous tool code: one session for every thread, the cancellation and the new flight are committed separately
+    old_flight = session.query(Flight).filter_by(ticket_num=ticket_num, status="open").first()
+    if old_flight is None:
+        return False
+    old_flight.status = "cancelled"
+    session.commit()
+    session.add(new_flight(old_flight))
+    session.commit()
+    return True
+
+def change_scoped(session, ticket_num):
+    # Current tool code, see confirm_flight_change
+    with session_scope(session) as db_session:
+        old_flight = db_session.query(Flight).filter_by(ticket_num=ticket_num, status="open").first()
+        if old_flight is None:
+            return False
+        if db_session.query(Flight).filter_by(id=old_flight.id, status="open").update({"status": "cancelled"}, synchronize_session=False) == 0:
+            return False
+        db_session.add(new_flight(old_flight))
+    return True
+
+def worker(change, session, tickets, changes, counts, lock):
+    done = failed = errors = 0
+    for _ in range(changes):
+        try:
+            if change(session, random.choice(tickets)):
+                done += 1
+            else:
+                failed += 1
+        except Exception:
+            errors += 1
+            try:
+                session.rollback()
+            except Exception:
+                pass
+    with lock:
+        counts.update(done=done, not_found=failed, errors=errors)
+
+def check_consistency(engine, customers, flights_per_customer):
+    # Returns the number of violations: customers whose open flight count changed, cancelled tickets without exactly
+    # one replacement of the same customer, and replacements of tickets that were never cancelled
+    with engine.connect() as connection:
+        open_counts = dict(connection.execute(text("SELECT customer_id, COUNT(*) FROM flights WHERE status = 'open' GROUP BY customer_id")).fetchall())
+        cancelled = dict(connection.execute(text("SELECT ticket_num, customer_id FROM flights WHERE status = 'cancelled'")).fetchall())
+        replacements = connection.execute(text("SELECT replaces, customer_id FROM flights WHERE replaces IS NOT NULL")).fetchall()
+    violations = sum(1 for customer in range(customers) if open_counts.get(str(customer), 0) != flights_per_customer)
+    replaced = Counter(ticket_num for ticket_num, _ in replacements)
+    violations += sum(1 for ticket_num in cancelled if replaced[ticket_num] != 1)
+    violations += sum(1 for ticket_num, customer_id in replacements if cancelled.get(ticket_num) != customer_id)
+    return violations
+
+def run(name, change, engine, session, args):
+    tickets = [f"{customer:06d}{i}" for customer in range(args.customers) for i in range(args.flights_per_customer)]
+    counts, lock = Counter(), threading.Lock()
+    threads = [threading.Thread(target=worker, args=(change, session, tickets, args.changes // args.threads, counts, lock)) for _ in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if hasattr(session, "remove"):
+        session.remove()
+    else:
+        session.close()
+    violations = check_consistency(engine, args.customers, args.flights_per_customer)
+    engine.dispose()
+    print(f"{name:<10}{counts['done'] / elapsed:>12.0f}{counts['done']:>8}{counts['not_found']:>11}{counts['errors']:>8}{violations:>12}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Stress test concurrent booking changes for throughput and cross-talk")
+    arg_parser.add_argument("--threads", type=int, default=8)
+    arg_parser.add_argument("--changes", type=int, default=2000, help="change attempts across all threads")
+    arg_parser.add_argument("--customers", type=int, default=200, help="fewer customers means more threads racing on the same tickets")
+    arg_parser.add_argument("--flights-per-customer", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    print(f"{args.threads} threads, {args.changes} change attempts on {args.customers * args.flights_per_customer} tickets")
+    print(f"{'session':<10}{'changes/s':>12}{'done':>8}{'not found':>11}{'errors':>8}{'violations':>12}")
+    work_dir = tempfile.mkdtemp()
+    for name, change, factory in [("shared", change_shared, lambda engine: sessionmaker(bind=engine)()),
+                                  ("scoped", change_scoped, lambda engine: scoped_session(sessionmaker(bind=engine)))]:
+        db_path = os.path.join(work_dir, f"{name}.db")
+        create_database(db_path, args.customers, args.flights_per_customer)
+        engine = create_sqlite_engine(db_path, wal=True, pool_size=args.threads)
+        run(name, change, engine, factory(engine), args)